@@ -9,6 +9,6 @@ app.config.from_object('app.config')
 celery = Celery(app.name, broker=app.config['CELERY_BROKER_URL'])
 celery.conf.update(app.config)
 
-CsrfProtect(app)
+csrf = CsrfProtect(app)
 
 from app import views
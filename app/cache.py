@@ -0,0 +1,65 @@
+import json
+import logging
+import hashlib
+from redis import RedisError
+
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """
+    Shared cache of classification results in Redis. Whole task results are
+    keyed by the normalized search query and limit, and single predictions by
+    the image url, so that overlapping queries only classify new images. All
+    keys include the model version to invalidate entries after retraining.
+    Errors of the Redis connection are logged and treated as cache misses.
+    """
+
+    def __init__(self, client, ttl=3600, prediction_ttl=7 * 24 * 3600):
+        self.client = client
+        self.ttl = ttl
+        self.prediction_ttl = prediction_ttl
+
+    def get_result(self, keywords, limit, version):
+        value = self._call('get', self._result_key(keywords, limit, version))
+        return json.loads(value.decode('utf-8')) if value else None
+
+    def put_result(self, keywords, limit, version, result):
+        key = self._result_key(keywords, limit, version)
+        self._call('setex', key, self.ttl, json.dumps(result))
+
+    def get_prediction(self, url, version):
+        value = self._call('get', self._prediction_key(url, version))
+        return json.loads(value.decode('utf-8')) if value else None
+
+    def put_predictions(self, predictions, version):
+        """
+        Store a dictionary from image urls to predicted labels.
+        """
+        if not predictions:
+            return
+        pipeline = self.client.pipeline(transaction=False)
+        for url, label in predictions.items():
+            key = self._prediction_key(url, version)
+            pipeline.setex(key, self.prediction_ttl, json.dumps(label))
+        try:
+            pipeline.execute()
+        except RedisError as error:
+            logger.warning('Could not store predictions: %s', error)
+
+    def _result_key(self, keywords, limit, version):
+        # The search is case insensitive but depends on the keyword order
+        query = ' '.join(' '.join(keywords).lower().split())
+        query = hashlib.sha1(query.encode('utf-8')).hexdigest()
+        return 'result:{}:{}:{}'.format(version, limit, query)
+
+    def _prediction_key(self, url, version):
+        url = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return 'prediction:{}:{}'.format(version, url)
+
+    def _call(self, method, *args):
+        try:
+            return getattr(self.client, method)(*args)
+        except RedisError as error:
+            logger.warning('Result cache unavailable: %s', error)
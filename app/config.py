@@ -3,14 +3,34 @@ import os
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
 
+# Cache of search results and single image predictions; TTLs are in seconds
+RESULT_CACHE_URL = CELERY_RESULT_BACKEND
+RESULT_CACHE_TTL = 3600
+PREDICTION_CACHE_TTL = 7 * 24 * 3600
+
 SECRET_KEY = 'CHANGE-ME'
 WTF_CSRF_ENABLED = True
 QUERY_LIMIT = 50
+# Download scaled renditions of this width instead of originals, images are
+# scaled down to at most 512 pixels when loading anyway
+THUMBNAIL_WIDTH = 512
+# Largest accepted image upload in bytes
+MAX_CONTENT_LENGTH = 16 * 1024 ** 2
+# Hosts that images classified by /predict may be downloaded from
+PREDICT_HOSTS = ['commons.wikimedia.org', 'upload.wikimedia.org']
 
 DOWNLOAD_DIRECTORY = 'downloads'
+# Cache of SPARQL responses, set to None to disable; TTL is in seconds
+QUERY_CACHE = os.path.join(DOWNLOAD_DIRECTORY, 'queries.db')
+QUERY_CACHE_TTL = 24 * 3600
+# Images shared between all workers, set to None to disable; size in bytes
+DOWNLOAD_CACHE = os.path.join(DOWNLOAD_DIRECTORY, 'images')
+DOWNLOAD_CACHE_SIZE = 2 * 1024 ** 3
 CLASSIFIER_DIRECTORY = 'classifier'
 
 WIKIMEDIA_CLASSIFIER = os.path.join(CLASSIFIER_DIRECTORY, 'classifier.pkl')
+# Used instead of the pickled classifier if present, see export_model.py
+COMPACT_CLASSIFIER = os.path.join(CLASSIFIER_DIRECTORY, 'classifier.model')
 FACE_CLASSIFIER = os.path.join(CLASSIFIER_DIRECTORY, 'trained-faces.xml')
 DATASET_CONFIG = os.path.join(CLASSIFIER_DIRECTORY, 'dataset.json')
 WORDS_CONFIG = os.path.join(CLASSIFIER_DIRECTORY, 'words.json')
@@ -0,0 +1,149 @@
+import os
+import json
+import glob
+import time
+import hashlib
+import logging
+import resource
+import threading
+from sklearn.externals import joblib
+from helper.model import load_model
+from feature.color import ColorFeature
+from feature.histogram import HistogramFeature
+from feature.gradient import GradientFeature
+from feature.face import FaceFeature
+from feature.geo import GeoFeature
+from feature.format import FormatFeature
+from feature.size import SizeFeature
+from feature.words import WordsFeature
+
+
+logger = logging.getLogger(__name__)
+
+# Extractors in the order of their features, unless the dataset config lists
+# a selection of them
+EXTRACTORS = ('size', 'color', 'histogram', 'gradient', 'face', 'geo',
+    'format', 'words')
+
+
+class ModelRegistry:
+    """
+    Holds the trained classifier, the feature extractors and the statistics
+    used for normalization. Everything is loaded once per process, either when
+    a worker process starts or on first use, and shared between all tasks
+    running in that process.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.loaded = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if self.loaded:
+                return
+            start, memory = time.time(), _peak_memory()
+            self.classifier = self._measure('classifier',
+                self._load_classifier)
+            self.means, self.stds, self.selected = self._measure(
+                'normalization', self._load_statistics,
+                self.config['DATASET_CONFIG'])
+            self._extractors = self._measure('extractors',
+                self._create_extractors)
+            self.version = self._compute_version()
+            self.loaded = True
+            logger.info('Loaded models in %.2f s, peak memory grew by %.1f MB',
+                time.time() - start, _peak_memory() - memory)
+
+    def get_classifier(self):
+        self.load()
+        return self.classifier
+
+    def get_statistics(self):
+        self.load()
+        return self.means, self.stds
+
+    def get_extractors(self):
+        self.load()
+        return list(self._extractors)
+
+    def get_version(self):
+        """
+        Return a hash of the model files, so that results can be cached until
+        the models are retrained.
+        """
+        self.load()
+        return self.version
+
+    def _load_classifier(self):
+        # The exported model loads faster and its pages are shared between
+        # worker processes
+        compact = self.config['COMPACT_CLASSIFIER']
+        pickled = self.config['WIKIMEDIA_CLASSIFIER']
+        if os.path.isfile(compact):
+            # Do not serve a stale export after the classifier was retrained
+            stale = os.path.isfile(pickled) and (
+                os.path.getmtime(compact) < os.path.getmtime(pickled))
+            if not stale:
+                logger.info('Load classifier from %s', compact)
+                return load_model(compact)
+            logger.warning('Ignore %s since it is older than %s, export the '
+                'classifier again to load faster', compact, pickled)
+        logger.info('Load classifier from %s', pickled)
+        return joblib.load(pickled)
+
+    def _load_statistics(self, filename):
+        with open(filename) as file_:
+            config = json.load(file_)
+        # Classifiers trained by selection.py list the extractors they use
+        return config['means'], config['stds'], config.get('extractors')
+
+    def _create_extractors(self):
+        """
+        Create the extractors the classifier was trained with, so that
+        extractors it does not need are never run.
+        """
+        factories = {
+            'size': SizeFeature,
+            'color': ColorFeature,
+            'histogram': HistogramFeature,
+            'gradient': GradientFeature,
+            'face': lambda: FaceFeature(self.config['FACE_CLASSIFIER']),
+            'geo': GeoFeature,
+            'format': FormatFeature,
+            'words': lambda: WordsFeature.create_from(
+                self.config['WORDS_CONFIG']),
+        }
+        names = self.selected or EXTRACTORS
+        extractors = [factories[x]() for x in names]
+        length = sum(len(list(x.keys())) for x in extractors)
+        assert length == len(self.means), ('Extractors do not match the '
+            'normalization statistics')
+        return extractors
+
+    def _compute_version(self):
+        keys = ('WIKIMEDIA_CLASSIFIER', 'COMPACT_CLASSIFIER',
+            'DATASET_CONFIG', 'WORDS_CONFIG', 'FACE_CLASSIFIER')
+        version = hashlib.sha1()
+        for key in keys:
+            # Joblib stores arrays in separate files next to the pickle
+            for filename in sorted(glob.glob(self.config[key] + '*')):
+                with open(filename, 'rb') as file_:
+                    version.update(file_.read())
+        return version.hexdigest()[:12]
+
+    def _measure(self, name, function, *args):
+        start, memory = time.time(), _peak_memory()
+        result = function(*args)
+        logger.info('Loaded %s in %.2f s, peak memory grew by %.1f MB', name,
+            time.time() - start, _peak_memory() - memory)
+        return result
+
+
+def _peak_memory():
+    """
+    Peak resident memory of the current process in megabytes.
+    """
+    # Reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
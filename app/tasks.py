@@ -1,25 +1,42 @@
-import os
-import json
 import numpy as np
 from app import app, celery
+from app.models import ModelRegistry
+from app.cache import ResultCache
+from redis import StrictRedis
+from celery.signals import worker_process_init
 from flask import copy_current_request_context
+import helper.dbpedia as dbpedia
 from helper.dbpedia import fetch_uris_from_metadata
-from helper.download import delete_directory
-from fetch_commons import images_and_metadata
+from helper.cache import QueryCache, DownloadCache
+import helper.download as download
+from helper.download import get_filename
+from fetch_commons import fetch_images
 from extraction import read_samples
 from helper.dataset import Dataset
-from feature.color import ColorFeature
-from feature.histogram import HistogramFeature
-from feature.blob import BlobFeature
-from feature.gradient import GradientFeature
-from feature.face import FaceFeature
-from feature.brief import BriefFeature
-from feature.geo import GeoFeature
-from feature.format import FormatFeature
-from feature.size import SizeFeature
-from feature.words import WordsFeature
-from feature.random import RandomFeature
-from sklearn.externals import joblib
+from helper.sample import Sample
+
+
+# Models and extractors shared by all tasks of a worker process
+models = ModelRegistry(app.config)
+
+# Results and predictions shared between all workers
+results = ResultCache(StrictRedis.from_url(app.config['RESULT_CACHE_URL']),
+    app.config['RESULT_CACHE_TTL'], app.config['PREDICTION_CACHE_TTL'])
+
+# Repeated searches for the same keywords are answered from disk
+if app.config['QUERY_CACHE']:
+    dbpedia.cache = QueryCache(app.config['QUERY_CACHE'],
+        app.config['QUERY_CACHE_TTL'])
+
+# Images requested by multiple searches are only downloaded once
+if app.config['DOWNLOAD_CACHE']:
+    download.cache = DownloadCache(app.config['DOWNLOAD_CACHE'],
+        app.config['DOWNLOAD_CACHE_SIZE'])
+
+
+@worker_process_init.connect
+def load_models(**kwargs):
+    models.load()
 
 
 class Observer:
@@ -32,11 +49,18 @@ class ProgressObserver(Observer):
         self.outer = outer
         self.current = current
         self.total = total
+        self.results = []
     def update(self, current=0, total=100, offset=0):
         self.current = offset + (current / total * 100)
+        self.publish()
+    def add_result(self, entry):
+        self.results.append(entry)
+        self.publish()
+    def publish(self):
         self.outer.update_state(
             state='PROGRESS',
-            meta={'current': self.current, 'total': self.total}
+            meta={'current': self.current, 'total': self.total,
+                'result': self.results}
         )
 
 
@@ -66,24 +90,12 @@ def classify_images(self, keywords=[], limit=25):
         raise AssertionError
 
     with app.app_context():
-        def supported_extractors():
-            extractors = []
-            extractors.append(SizeFeature())
-            extractors.append(ColorFeature())
-            extractors.append(HistogramFeature())
-            extractors.append(GradientFeature())
-            extractors.append(FaceFeature(app.config['FACE_CLASSIFIER']))
-            extractors.append(GeoFeature())
-            extractors.append(FormatFeature())
-            extractors.append(WordsFeature.create_from(app.config['WORDS_CONFIG']))
-            return extractors
-
-        def create_response_entry(label, sample):
+        def create_response_entry(label, metadata):
             return {
-                'thumbnail': sample.thumbnail,
-                'image': sample.url,
+                'thumbnail': metadata['thumbnail'],
+                'image': metadata['url'],
                 'label': label,
-                'title': sample.url
+                'title': metadata['url']
             }
 
         def create_response(entries):
@@ -97,43 +109,101 @@ def classify_images(self, keywords=[], limit=25):
         progress_observer = ProgressObserver(self)
         progress_observer.update(5)
 
-        # query dpedia for related images based on given keywords
+        # reuse the result of an identical recent search
         if limit > app.config['QUERY_LIMIT']:
             limit = app.config['QUERY_LIMIT']
+        version = models.get_version()
+        result = results.get_result(keywords, limit, version)
+        if result:
+            progress_observer.update(100)
+            return result
+
+        # query dpedia for related images based on given keywords
         searchterm = ' '.join(keywords)
         uris = fetch_uris_from_metadata(searchterm, limit, multiple=False)
         progress_observer.update(20)
 
-        # download images and metadata into temp folder with unique task id
-        temp_folder = os.path.join(app.config['DOWNLOAD_DIRECTORY'], classify_images.request.id)
-        images_and_metadata(uris, temp_folder, False, observer=progress_observer)
-        progress_observer.update(80)
-
-        # load dataset and extract features
-        dataset = Dataset(logging=True)
-        dataset.read(root=temp_folder, extractors=supported_extractors(), unlabeled_data=True)
-        dataset_config = json.load(open(app.config['DATASET_CONFIG']))
-        dataset.means = dataset_config['means']
-        dataset.stds = dataset_config['stds']
-        dataset.normalize()
-        progress_observer.update(90)
-
-        # predict labels using the trained classifier
-        classifier = joblib.load(app.config['WIKIMEDIA_CLASSIFIER'])
-        predictions = classifier.predict(dataset.data)
+        # download images and metadata into memory, except for images that
+        # were already classified
+        known = {}
+        def is_known(metadata):
+            label = results.get_prediction(metadata['url'], version)
+            if label is not None:
+                known[metadata['url']] = label
+            return label is not None
+
+        # classify and publish each image as soon as it is downloaded
+        predicted = {}
+        for metadata, content in fetch_images(uris, False,
+                observer=progress_observer, skip_download=is_known,
+                thumbnails=app.config['THUMBNAIL_WIDTH']):
+            url = metadata['url']
+            if content is None:
+                label = known[url]
+            else:
+                # assign a required dummy label
+                sample = Sample(get_filename(url), 0, content, metadata)
+                extracted, labels = classify([sample])
+                if not extracted:
+                    continue
+                label = predicted[url] = labels[0]
+            progress_observer.add_result(create_response_entry(label,
+                metadata))
+        results.put_predictions(predicted, version)
         progress_observer.update(95)
 
         # build response
-        suggestions = []
-        for index, sample in enumerate(dataset.samples):
-            label = np.asscalar(predictions[index])
-            entry = create_response_entry(label, sample)
-            suggestions.append(entry)
+        suggestions = progress_observer.results
         result = create_response(suggestions)
-
-        # cleanup temporary directory
-        delete_directory(temp_folder)
+        if suggestions:
+            results.put_result(keywords, limit, version, result)
 
         progress_observer.update(100)
 
         return result
+
+
+def extract(samples):
+    """
+    Extract and normalize features of the samples using the shared models.
+    """
+    dataset = Dataset()
+    dataset.extract(samples, extractors=models.get_extractors())
+    if len(dataset.data):
+        dataset.means, dataset.stds = models.get_statistics()
+        dataset.normalize()
+    return dataset
+
+
+def classify(samples):
+    """
+    Extract features of the samples and predict their labels using the
+    shared models. Returns the successfully extracted samples and their
+    labels.
+    """
+    dataset = extract(samples)
+    if not len(dataset.data):
+        return [], []
+    predictions = models.get_classifier().predict(dataset.data)
+    return dataset.extracted, [np.asscalar(x) for x in predictions]
+
+
+def predict_image(filename, content, metadata):
+    """
+    Classify a single image in the current process. Returns the label and a
+    dictionary from labels to probabilities, which is None if the classifier
+    does not support probability estimates. Returns None if the features
+    could not be extracted.
+    """
+    dataset = extract([Sample(filename, 0, content, metadata)])
+    if not len(dataset.data):
+        return None
+    classifier = models.get_classifier()
+    label = np.asscalar(classifier.predict(dataset.data)[0])
+    probabilities = None
+    # Only available for SVMs trained with probability estimates enabled
+    if hasattr(classifier, 'predict_proba'):
+        values = classifier.predict_proba(dataset.data)[0]
+        probabilities = {np.asscalar(x): float(y)
+            for x, y in zip(classifier.classes_, values)}
+    return label, probabilities
@@ -1,10 +1,26 @@
-from flask import render_template, flash, redirect, url_for, jsonify
-from app import app, celery
+from flask import (render_template, flash, redirect, url_for, jsonify,
+    request)
+from app import app, celery, csrf
 from .forms import SuggestForm
-from .tasks import start_context_aware_task, classify_images
+from .tasks import (start_context_aware_task, classify_images, predict_image,
+    models)
+from helper.dbpedia import METADATA
+from helper.download import Downloader, DownloadError, get_filename
+import os
 import random
 
 
+# Shared by requests to reuse connections to the same hosts. Only downloads
+# from the allowed hosts, so that clients cannot make the server request
+# internal addresses.
+downloader = Downloader(hosts=app.config['PREDICT_HOSTS'])
+
+
+@app.before_first_request
+def load_models():
+    models.load()
+
+
 @app.route('/')
 @app.route('/index')
 def index():
@@ -33,6 +49,11 @@ def suggest():
 
 @app.route('/status/<task_id>')
 def status(task_id):
+    """
+    Report the progress of a task and the results published so far. Clients
+    pass the cursor of their previous response to only receive new results.
+    """
+    cursor = request.args.get('cursor', 0, type=int)
     task = classify_images.AsyncResult(task_id)
     if task.state == 'PENDING':
         response = {'state': task.state,
@@ -46,7 +67,8 @@ def status(task_id):
             'total': task.info.get('total', 1)
         }
         if 'result' in task.info:
-            response['result'] = task.info['result']
+            response['result'] = task.info['result'][cursor:]
+            response['cursor'] = len(task.info['result'])
     else:
         # something went wrong in the background job
         response = {
@@ -56,3 +78,44 @@ def status(task_id):
             'status': str(task.info),  # this is the exception raised
         }
     return jsonify(response)
+
+
+@app.route('/predict', methods=['POST'])
+@csrf.exempt
+def predict():
+    """
+    Classify a single image synchronously. The image is either uploaded as
+    the image file or downloaded from the url field, which must point to
+    Wikimedia Commons. Other metadata fields like title and description are
+    optional. Returns the predicted label and the class probabilities if the
+    classifier supports them.
+    """
+    metadata = {key: request.form.get(key, '') for key in METADATA}
+    upload = request.files.get('image')
+    if upload:
+        filename = upload.filename
+        content = upload.read()
+    elif metadata['url']:
+        if not downloader.is_allowed(metadata['url']):
+            return jsonify({'error': 'Only urls of the hosts {} are '
+                'supported'.format(', '.join(downloader.hosts))}), 400
+        filename = get_filename(metadata['url'])
+        try:
+            content = downloader.download(metadata['url'])
+        except DownloadError as error:
+            return jsonify({'error': str(error)}), 502
+    else:
+        return jsonify({'error': 'Provide an image file or url'}), 400
+    if not metadata['extension']:
+        metadata['extension'] = os.path.splitext(filename)[1][1:].lower()
+
+    prediction = predict_image(filename, content, metadata)
+    if prediction is None:
+        return jsonify({'error': 'Could not extract features'}), 422
+    label, probabilities = prediction
+    labels = app.config['CATEGORY_LABELS']
+    response = {'label': label, 'category': labels[label]}
+    if probabilities is not None:
+        response['probabilities'] = {labels[x]: y
+            for x, y in probabilities.items()}
+    return jsonify(response)
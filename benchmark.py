@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import random
+import platform
+import numpy as np
+from PIL import Image
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+import helper.image as image
+from helper.sample import Sample, REQUIREMENTS
+from helper.dbpedia import METADATA
+from helper.download import ensure_directory
+from helper.utility import print_headline
+from feature.size import SizeFeature
+from feature.color import ColorFeature
+from feature.histogram import HistogramFeature
+from feature.gradient import GradientFeature
+from feature.blob import BlobFeature
+from feature.face import FaceFeature
+from feature.geo import GeoFeature
+from feature.format import FormatFeature
+from feature.words import WordsFeature
+
+
+FORMATS = ('jpg', 'png', 'gif', 'svg')
+SIZES = ((320, 240), (1024, 768), (3000, 2000))
+
+
+def generate_corpus(directory, count, seed=0):
+    """
+    Write a deterministic set of synthetic images in all supported formats and
+    sizes into the directory. Every second image gets a JSON metadata file.
+    Returns the list of image filenames.
+    """
+    ensure_directory(directory)
+    generator = np.random.RandomState(seed)
+    words = random.Random(seed)
+    filenames = []
+    for extension in FORMATS:
+        for width, height in SIZES:
+            for index in range(count):
+                name = '{}-{}x{}-{}'.format(extension, width, height, index)
+                filename = os.path.join(directory, name + '.' + extension)
+                filenames.append(filename)
+                if os.path.isfile(filename):
+                    continue
+                if extension == 'svg':
+                    write_svg(filename, width, height, generator)
+                else:
+                    write_raster(filename, width, height, generator)
+                if index % 2 == 0:
+                    write_metadata(filename, name, extension, words)
+    return filenames
+
+
+def write_raster(filename, width, height, generator):
+    # Smooth color gradients with random blocks so that all extractors have
+    # some structure to work on
+    x = np.linspace(0, 1, width)[np.newaxis, :, np.newaxis]
+    y = np.linspace(0, 1, height)[:, np.newaxis, np.newaxis]
+    colors = generator.rand(3, 3)
+    pixels = x * colors[0] + y * colors[1] + (1 - x) * (1 - y) * colors[2]
+    for _ in range(8):
+        left, top = generator.randint(0, width), generator.randint(0, height)
+        right = left + generator.randint(1, width // 4 + 2)
+        bottom = top + generator.randint(1, height // 4 + 2)
+        pixels[top:bottom, left:right] = generator.rand(3)
+    pixels = np.uint8(255 * np.clip(pixels, 0, 1))
+    Image.fromarray(pixels, 'RGB').save(filename)
+
+
+def write_svg(filename, width, height, generator):
+    shapes = []
+    for _ in range(8):
+        x, y = generator.randint(0, width), generator.randint(0, height)
+        radius = generator.randint(1, min(width, height) // 4 + 2)
+        color = '#{:06x}'.format(generator.randint(0, 0xffffff))
+        shapes.append('<circle cx="{}" cy="{}" r="{}" fill="{}"/>'.format(
+            x, y, radius, color))
+    svg = ('<svg xmlns="http://www.w3.org/2000/svg" width="{}" height="{}">'
+        '{}</svg>').format(width, height, ''.join(shapes))
+    with open(filename, 'w') as file_:
+        file_.write(svg)
+
+
+def write_metadata(filename, name, extension, words):
+    vocabulary = ['view', 'portrait', 'map', 'flag', 'building', 'church',
+        'mountain', 'logo', 'chart', 'painting', 'car', 'station', 'river']
+    metadata = {key: '' for key in METADATA}
+    metadata['url'] = 'http://commons.wikimedia.org/File:' + name
+    metadata['extension'] = extension
+    metadata['title'] = ' '.join(words.sample(vocabulary, 3))
+    metadata['description'] = ' '.join(words.choice(vocabulary)
+        for _ in range(30))
+    if words.random() < 0.5:
+        metadata['lat'], metadata['long'] = '52.39', '13.13'
+    basename = os.path.splitext(filename)[0]
+    with open(basename + '.json', 'w') as file_:
+        json.dump(metadata, file_)
+
+
+def measure(function, inputs, repeat):
+    """
+    Return the number of inputs the function processes per second. The best
+    of multiple runs is used to reduce noise.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for input_ in inputs:
+            function(input_)
+        best = min(best, time.perf_counter() - start)
+    return len(inputs) / best if best else float('inf')
+
+
+def measure_batch(extractor, samples, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        extractor.extract_batch(samples)
+        best = min(best, time.perf_counter() - start)
+    return len(samples) / best if best else float('inf')
+
+
+def benchmark_image(filenames, repeat):
+    results = {}
+    results['probe_size'] = measure(image.probe_size, filenames, repeat)
+    results['load'] = measure(image.load, filenames, repeat)
+    originals = [image.load(x)[0] for x in filenames]
+    results['preprocess'] = measure(image.preprocess, originals, repeat)
+    images = [image.preprocess(x) for x in originals]
+    results['convert_to_hsv'] = measure(image.convert_to_hsv, images, repeat)
+    results['convert_to_gray'] = measure(image.convert_to_gray, images,
+        repeat)
+    return results
+
+
+def benchmark_extractors(filenames, extractors, repeat):
+    results = {}
+    for extractor in extractors:
+        samples = [Sample(x) for x in filenames]
+        # Load the attributes the extractor relies on before timing, so that
+        # only the extractor itself is measured
+        for sample in samples:
+            for key in REQUIREMENTS.get(extractor.name(), ()):
+                getattr(sample, key)
+        results[extractor.name()] = measure_batch(extractor, samples, repeat)
+    return results
+
+
+def create_extractors(trained_faces, words):
+    extractors = [SizeFeature(), ColorFeature(), HistogramFeature(),
+        GradientFeature(), BlobFeature()]
+    if os.path.isfile(trained_faces):
+        extractors.append(FaceFeature(trained_faces))
+    else:
+        print('Skip face feature since the trained face detector was not '
+            'found at {}.'.format(trained_faces))
+    extractors.append(GeoFeature())
+    extractors.append(FormatFeature())
+    extractors.append(WordsFeature.create_from(words))
+    return extractors
+
+
+def print_results(results, baseline=None):
+    row = '| {: <20} | {: >12} | {: >12} | {: >7} |'
+    print(row.format('benchmark', 'samples/s', 'baseline', 'ratio'))
+    print(row.format('-' * 20, '-' * 12, '-' * 12, '-' * 7))
+    for name, value in sorted(results.items()):
+        reference, ratio = '', ''
+        if baseline and name in baseline:
+            reference = '{:.1f}'.format(baseline[name])
+            ratio = '{:.2f}'.format(value / baseline[name])
+        print(row.format(name, '{:.1f}'.format(value), reference, ratio))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Measure the speed of image loading, '
+        'preprocessing and feature extraction on a synthetic corpus.',
+        formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-d', '--directory', default='data/benchmark',
+        help='Directory of the synthetic corpus; gets generated if needed')
+    parser.add_argument('-n', '--count', type=int, default=4,
+        help='Number of images per format and size')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+        help='Number of runs per benchmark of which the fastest is used')
+    parser.add_argument('-f', '--trained-faces',
+        default='classifier/trained-faces.xml',
+        help='Path to a trained face detection classifier')
+    parser.add_argument('-w', '--words', default='classifier/words.json',
+        help='Path to the stored vocabulary of the words feature')
+    parser.add_argument('-o', '--output',
+        default='<directory>/benchmark.json',
+        help='Where to store the results as JSON')
+    parser.add_argument('-b', '--baseline',
+        help='Results of a previous run to compare against')
+    args = parser.parse_args()
+
+    args.output = args.output.replace('<directory>', args.directory)
+
+    filenames = generate_corpus(args.directory, args.count)
+    print('Benchmark on', len(filenames), 'images in', args.directory)
+    extractors = create_extractors(args.trained_faces, args.words)
+    results = benchmark_image(filenames, args.repeat)
+    results.update(benchmark_extractors(filenames, extractors, args.repeat))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file_:
+            baseline = json.load(file_)['results']
+    print_headline('Results')
+    print_results(results, baseline)
+
+    content = {
+        'python': platform.python_version(),
+        'count': len(filenames),
+        'repeat': args.repeat,
+        'results': results
+    }
+    with open(args.output, 'w') as file_:
+        json.dump(content, file_, indent=2)
+    print('\nWrite results to', args.output)
@@ -1,7 +1,13 @@
 import os
+import json
+import time
+import hashlib
 import numpy as np
+from multiprocessing import Pool
 import matplotlib.pyplot as plt
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from sklearn.base import clone
+from sklearn.cross_validation import train_test_split, StratifiedKFold
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import f1_score, classification_report
 from sklearn.metrics import confusion_matrix
@@ -41,9 +47,9 @@ class Prediction:
         plt.show()
 
 
-def train_and_predict(classifier, dataset, split, log=True):
+def train_and_predict(classifier, dataset, split, log=True, seed=None):
     # Convert to numpy arrays and split
-    training, testing = dataset.split(split, log)
+    training, testing = dataset.split(split, log, seed)
     # Normalize dataset
     training.normalize()
     testing.means, testing.stds = training.means, training.stds
@@ -56,33 +62,269 @@ def train_and_predict(classifier, dataset, split, log=True):
     return prediction
 
 
-def evaluate_classifier(dataset, classifier, iterations, split):
+def evaluate_classifier(dataset, classifier, iterations, split, workers=1,
+        seed=0):
     # TODO: Move into performance.py
-    scores = []
-    for _ in range(iterations):
-        prediction = train_and_predict(classifier, dataset, split, log=False)
-        score = f1_score(prediction.true, prediction.predicted,
-            average='weighted')
-        scores.append(score)
+    results = evaluate_classifiers(dataset, {'': classifier}, iterations,
+        split, workers, seed)
+    scores, _, _ = results['']
     worst = min(scores)
     average = sum(scores) / len(scores)
     best = max(scores)
     return worst, average, best
 
 
+class EvaluationPlan:
+    """
+    Train and test splits of a dataset together with the normalization
+    statistics of each training set. Splits are either repeated random
+    holdouts or the folds of a repeated stratified k-fold cross validation.
+    Computing them once lets all classifiers reuse them and be compared on
+    identical splits. Plans can be stored, for example next to the dataset,
+    and know the dataset and parameters they were created with.
+    """
+
+    def __init__(self):
+        self.tests = None
+        self.means = None
+        self.stds = None
+        self.parameters = None
+        self.fingerprint = None
+
+    def create(self, dataset, iterations, split, seed=0):
+        """
+        Create one random split per iteration, seeded with seed plus the
+        iteration.
+        """
+        indices = np.arange(len(dataset.target))
+        tests = np.zeros((iterations, len(indices)), dtype=bool)
+        for iteration in range(iterations):
+            _, test = train_test_split(indices, test_size=split,
+                random_state=seed + iteration)
+            tests[iteration, test] = True
+        parameters = dict(iterations=iterations, split=split, seed=seed)
+        self._create(dataset, tests, parameters)
+
+    def create_folds(self, dataset, folds, repeats=1, seed=0):
+        """
+        Split into folds that preserve the fraction of samples of each class.
+        Each repetition shuffles the samples with seed plus the repetition.
+        Iterations are ordered by repetition and then fold.
+        """
+        tests = np.zeros((folds * repeats, len(dataset.target)), dtype=bool)
+        for repeat in range(repeats):
+            splits = StratifiedKFold(dataset.target, folds, shuffle=True,
+                random_state=seed + repeat)
+            for fold, (_, test) in enumerate(splits):
+                tests[repeat * folds + fold, test] = True
+        parameters = dict(folds=folds, repeats=repeats, seed=seed)
+        self._create(dataset, tests, parameters)
+
+    def load(self, filename):
+        with np.load(filename) as content:
+            for key in ('tests', 'means', 'stds'):
+                setattr(self, key, content[key])
+            self.parameters = json.loads(str(content['parameters']))
+            self.fingerprint = str(content['fingerprint'])
+
+    def save(self, filename):
+        # Passing a file object avoids the automatic .npz extension
+        with open(filename, 'wb') as file_:
+            np.savez_compressed(file_, tests=self.tests, means=self.means,
+                stds=self.stds, parameters=json.dumps(self.parameters),
+                fingerprint=self.fingerprint)
+
+    def matches(self, dataset, parameters):
+        """
+        Whether the plan was created from the dataset with the parameters of
+        either create() or create_folds() given as dictionary.
+        """
+        if self.parameters != parameters:
+            return False
+        return self.fingerprint == self._fingerprint(dataset)
+
+    def iterations(self):
+        return len(self.tests)
+
+    def seed(self, iteration):
+        return self.parameters['seed'] + iteration
+
+    def subsets(self, dataset, iteration):
+        """
+        Return the normalized training and testing datasets of an iteration.
+        """
+        training = dataset.subset(np.flatnonzero(~self.tests[iteration]))
+        testing = dataset.subset(np.flatnonzero(self.tests[iteration]))
+        for subset in (training, testing):
+            subset.means = self.means[iteration].tolist()
+            subset.stds = self.stds[iteration].tolist()
+            subset.normalize()
+        return training, testing
+
+    def out_of_fold(self, predictions):
+        """
+        Combine the predictions of all folds into a matrix with a row per
+        repetition holding the prediction for every sample of the dataset.
+        """
+        assert 'folds' in self.parameters, 'Plan has no folds'
+        repeats = self.parameters['repeats']
+        folds = self.parameters['folds']
+        matrix = np.zeros((repeats, self.tests.shape[1]), dtype=int)
+        for iteration, predicted in enumerate(predictions):
+            matrix[iteration // folds, self.tests[iteration]] = predicted
+        return matrix
+
+    def _create(self, dataset, tests, parameters):
+        means, stds = [], []
+        for test in tests:
+            training = dataset.data[np.flatnonzero(~test)]
+            means.append(training.mean(axis=0))
+            std = training.std(axis=0)
+            # Constant features are left unscaled like by StandardScaler
+            std[std == 0] = 1
+            stds.append(std)
+        self.tests = tests
+        self.means, self.stds = np.array(means), np.array(stds)
+        self.parameters = parameters
+        self.fingerprint = self._fingerprint(dataset)
+
+    def _fingerprint(self, dataset):
+        fingerprint = hashlib.sha1()
+        fingerprint.update(json.dumps(dataset.features).encode('utf-8'))
+        fingerprint.update(np.ascontiguousarray(dataset.data).tobytes())
+        fingerprint.update(np.ascontiguousarray(dataset.target).tobytes())
+        return fingerprint.hexdigest()
+
+
+def evaluate_classifiers(dataset, classifiers, iterations, split, workers=1,
+        seed=0, plan=None):
+    """
+    Train and test each classifier on the same random splits, one per
+    iteration. Splits and the random state of classifiers are seeded, so that
+    results are reproducible. The splits and their normalization statistics
+    are taken from the plan if given, otherwise a plan is created. All
+    combinations of classifiers and iterations are evaluated in parallel by
+    the worker processes, which share the data of the dataset with the parent
+    process. Returns a dictionary from classifier names to their F1 scores,
+    the seconds spent training and testing them and their predictions for
+    the test set of each iteration.
+    """
+    if plan is None:
+        plan = EvaluationPlan()
+        plan.create(dataset, iterations, split, seed)
+    iterations = plan.iterations()
+    # Consecutive tasks of the same iteration reuse its subsets
+    grid = [(name, iteration) for iteration in range(iterations)
+        for name in classifiers]
+    results = {name: ([None] * iterations, 0, [None] * iterations)
+        for name in classifiers}
+    if workers <= 1:
+        _initialize_worker(dataset, classifiers, plan)
+        evaluations = map(_evaluate_worker, grid)
+        for (name, iteration), evaluation in zip(grid, evaluations):
+            _store_result(results, name, iteration, evaluation)
+        return results
+    # Worker processes are forked, so they access the data without copying
+    arguments = dataset, classifiers, plan
+    with Pool(workers, _initialize_worker, arguments) as pool:
+        # Chunks of one iteration each, so that workers reuse its subsets
+        evaluations = pool.imap(_evaluate_worker, grid, len(classifiers))
+        for (name, iteration), evaluation in zip(grid, evaluations):
+            _store_result(results, name, iteration, evaluation)
+    return results
+
+
+def cross_validate(dataset, classifiers, folds, repeats=1, workers=1, seed=0,
+        plan=None):
+    """
+    Evaluate each classifier with a repeated stratified k-fold cross
+    validation with folds trained and tested in parallel. Returns a
+    dictionary from classifier names to their F1 scores per fold, the seconds
+    spent training and testing them and their out-of-fold predictions as
+    matrix with a row per repetition.
+    """
+    if plan is None:
+        plan = EvaluationPlan()
+        plan.create_folds(dataset, folds, repeats, seed)
+    results = evaluate_classifiers(dataset, classifiers, None, None, workers,
+        plan=plan)
+    for name, (scores, seconds, predictions) in results.items():
+        results[name] = scores, seconds, plan.out_of_fold(predictions)
+    return results
+
+
+def save_out_of_fold(filename, dataset, results):
+    """
+    Store the out-of-fold predictions of each classifier together with the
+    true targets, so that they can be analyzed without retraining.
+    """
+    matrices = {name: matrix for name, (_, _, matrix) in results.items()}
+    # Passing a file object avoids the automatic .npz extension
+    with open(filename, 'wb') as file_:
+        np.savez_compressed(file_, target=dataset.target,
+            labels=dataset.labels, **matrices)
+
+
+def _store_result(results, name, iteration, evaluation):
+    score, seconds, predicted = evaluation
+    scores, total, predictions = results[name]
+    scores[iteration] = score
+    predictions[iteration] = predicted
+    results[name] = scores, total + seconds, predictions
+
+
+_worker_state = None
+_worker_subsets = None
+
+
+def _initialize_worker(dataset, classifiers, plan):
+    global _worker_state, _worker_subsets
+    _worker_state = dataset, classifiers, plan
+    _worker_subsets = None
+
+
+def _evaluate_worker(task):
+    global _worker_subsets
+    dataset, classifiers, plan = _worker_state
+    name, iteration = task
+    if _worker_subsets is None or _worker_subsets[0] != iteration:
+        _worker_subsets = (iteration,) + plan.subsets(dataset, iteration)
+    _, training, testing = _worker_subsets
+    classifier = clone(classifiers[name])
+    if 'random_state' in classifier.get_params():
+        classifier.set_params(random_state=plan.seed(iteration))
+    start = time.time()
+    classifier.fit(training.data, training.target)
+    predicted = classifier.predict(testing.data)
+    seconds = time.time() - start
+    score = f1_score(testing.target, predicted, average='weighted')
+    return score, seconds, predicted
+
+
 if __name__ == '__main__':
     parser = ArgumentParser(description='Learning algorithm used to classify '
         'images.',
         formatter_class=ArgumentDefaultsHelpFormatter)
     parser.add_argument('features',
-        help='Path to the JSON file containing extracted features of the '
-        'dataset')
+        help='Path to the JSON or binary file containing extracted features '
+        'of the dataset')
     parser.add_argument('-s', '--split', type=float, default=0.25,
         help='Fraction of data used for validation')
     parser.add_argument('-c', '--copy-predicted',
         default='<folder>/../<folder>-predicted/',
         help='Folder to copy predicted images into; sub directories for all '
         'labels are created; <folder> is the directory of the features file')
+    parser.add_argument('--cv', type=int,
+        help='Number of folds of a stratified cross validation to run '
+        'instead of a single split')
+    parser.add_argument('-r', '--repeat', type=int, default=1,
+        help='Number of times the cross validation is repeated with '
+        'different shuffles')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+        help='Number of processes to train and test folds in parallel')
+    parser.add_argument('-o', '--out-of-fold',
+        help='Filename to store the out-of-fold predictions of the cross '
+        'validation in as NumPy archive')
     args = parser.parse_args()
 
     if '<folder>' in args.copy_predicted:
@@ -93,6 +335,17 @@ if __name__ == '__main__':
     dataset.load(args.features)
 
     classifier = RandomForestClassifier(n_estimators=300)
-    prediction = train_and_predict(classifier, dataset, args.split)
+    if args.cv:
+        results = cross_validate(dataset, {'classifier': classifier},
+            args.cv, args.repeat, args.jobs)
+        scores, seconds, matrix = results['classifier']
+        print('F1 score {:.4f} +/- {:.4f} over {} folds in {:.2f}s'.format(
+            np.mean(scores), np.std(scores), len(scores), seconds))
+        if args.out_of_fold:
+            save_out_of_fold(args.out_of_fold, dataset, results)
+        true = np.tile(dataset.target, args.repeat)
+        prediction = Prediction(true, matrix.ravel(), dataset.labels)
+    else:
+        prediction = train_and_predict(classifier, dataset, args.split)
     prediction.print_scores()
     prediction.plot_confusion_matrix()
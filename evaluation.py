@@ -51,8 +51,8 @@ if __name__ == '__main__':
         'within the images of the same class to evaluate features.',
         formatter_class=ArgumentDefaultsHelpFormatter)
     parser.add_argument('features',
-        help='Path to the JSON file containing extracted features of the '
-        'dataset')
+        help='Path to the JSON or binary file containing extracted features '
+        'of the dataset')
     parser.add_argument('-o', '--output', default='<folder>/evaluation.csv',
         help='Filename of the CSV file where p-values will be written to; '
         '<folder> is the directory of the features file')
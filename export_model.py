@@ -0,0 +1,94 @@
+import os
+import sys
+import time
+import resource
+import multiprocessing
+import numpy as np
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from sklearn.externals import joblib
+from helper.model import export_verified, load_model
+from helper.utility import print_headline
+
+
+def measure_load(kind, filename):
+    """
+    Return the seconds and the growth of resident memory in megabytes needed
+    to load a model and make a first prediction. Meant to run in a fresh
+    process.
+    """
+    start, memory = time.time(), _resident_memory()
+    if kind == 'joblib':
+        model = joblib.load(filename)
+        features = _count_features(model)
+    else:
+        model = load_model(filename)
+        features = model.features
+    model.predict(np.zeros((1, features)))
+    return time.time() - start, _resident_memory() - memory
+
+
+def _count_features(classifier):
+    if hasattr(classifier, 'coef_'):
+        return classifier.coef_.shape[1]
+    return classifier.estimators_[0].tree_.n_features
+
+
+def _resident_memory():
+    # The peak reported by getrusage() is inherited by spawned processes, so
+    # read the current size on Linux instead
+    with open('/proc/self/statm') as file_:
+        pages = int(file_.read().split()[1])
+    return pages * resource.getpagesize() / 1024 ** 2
+
+
+def _measure_in_process(kind, filename):
+    # Spawn a fresh interpreter so that nothing is loaded or cached yet
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1) as pool:
+        return pool.apply(measure_load, (kind, filename))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Export a trained classifier into a '
+        'compact format that loads without unpickling and is shared between '
+        'processes; supports random forests and SVMs with linear kernel.',
+        formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('classifier',
+        help='Path to the classifier stored with joblib')
+    parser.add_argument('-o', '--output', default='<classifier>.model',
+        help='Where to store the exported model; <classifier> is the path '
+        'of the classifier without extension')
+    parser.add_argument('-n', '--samples', type=int, default=10000,
+        help='Number of random feature vectors to compare predictions on')
+    parser.add_argument('-c', '--compare', action='store_true',
+        help='Measure load time and memory of both formats in fresh '
+        'processes')
+    args = parser.parse_args()
+
+    basename = os.path.splitext(args.classifier)[0]
+    args.output = args.output.replace('<classifier>', basename)
+
+    classifier = joblib.load(args.classifier)
+    print('Export', type(classifier).__name__, 'to', args.output)
+    agreement = export_verified(classifier, args.output, args.samples)
+    print('Equal predictions on {:.2%} of {} samples'.format(agreement,
+        args.samples))
+    if agreement < 1:
+        print('Predictions differ, so no model was written')
+        sys.exit(1)
+
+    if args.compare:
+        print_headline('Load time and memory')
+        row = '| {: <8} | {: >10} | {: >10} | {: >10} |'
+        print(row.format('format', 'size MB', 'seconds', 'memory MB'))
+        print(row.format('-' * 8, '-' * 10, '-' * 10, '-' * 10))
+        joblib_size = sum(os.path.getsize(x) for x in
+            [args.classifier] + [args.classifier + '_{:02d}.npy'.format(i)
+            for i in range(1, 100)] if os.path.isfile(x))
+        sizes = {'joblib': joblib_size, 'compact':
+            os.path.getsize(args.output)}
+        filenames = {'joblib': args.classifier, 'compact': args.output}
+        for kind in ('joblib', 'compact'):
+            seconds, memory = _measure_in_process(kind, filenames[kind])
+            print(row.format(kind, '{:.1f}'.format(sizes[kind] / 1024 ** 2),
+                '{:.3f}'.format(seconds), '{:.1f}'.format(memory)))
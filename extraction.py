@@ -1,6 +1,9 @@
 import os
+import json
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 from helper.dataset import Dataset
+from helper.cache import FeatureCache
+from helper.profiling import Profiler
 from feature.color import ColorFeature
 from feature.histogram import HistogramFeature
 from feature.blob import BlobFeature
@@ -38,12 +41,42 @@ if __name__ == '__main__':
         default='data/trained-faces.xml',
         help='Path to a trained face detection classifier.')
     parser.add_argument('-o', '--output', default='<dataset>/dataset.json',
-        help='Where to store the extracted features')
+        help='Where to store the extracted features; files not ending in '
+        '.json are written in a compact binary format')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+        help='Number of processes to extract features in parallel')
+    parser.add_argument('-c', '--cache',
+        help='Filename of a feature cache to reuse features of unchanged '
+        'images and extractors from previous runs')
+    parser.add_argument('--cache-size', type=int, default=1024,
+        help='Maximum size of the feature cache in megabytes')
+    parser.add_argument('-u', '--update', action='store_true',
+        help='Update an existing output file by only extracting new and '
+        'changed images; keeps the stored vocabulary of textual features')
+    parser.add_argument('-p', '--profile',
+        help='Filename of a JSON report of time and memory spent in each '
+        'extractor and for loading sample attributes; also printed as table')
+    parser.add_argument('-e', '--extractors',
+        help='Dataset config written by selection.py; only the extractors it '
+        'lists are run and the vocabulary next to it is used; implies -v and '
+        '-t')
     args = parser.parse_args()
 
     args.output = args.output.replace('<dataset>', args.dataset)
+
+    selected = None
+    if args.extractors:
+        with open(args.extractors) as file_:
+            selected = json.load(file_)['extractors']
+        # The selection decides which extractors of both sources are run
+        args.visual = args.textual = True
     assert args.visual or args.textual, 'Need at least one feature source'
 
+    dataset = Dataset(logging=True)
+    update = args.update and os.path.isfile(args.output)
+    if update:
+        dataset.load(args.output)
+
     extractors = []
     if args.visual:
         extractors.append(SizeFeature())
@@ -58,14 +91,50 @@ if __name__ == '__main__':
             print('Skip face feature since the trained face detector was not '
                 'found at {}.'.format(args.trained_faces))
     if args.textual:
-        samples = read_samples(args.dataset)
-        if os.path.isfile(args.stopwords):
-            args.stopwords = open(args.stopwords)
         extractors.append(GeoFeature())
         extractors.append(FormatFeature())
-        extractors.append(WordsFeature(samples, args.stopwords))
+    # Building the vocabulary reads the metadata of all samples
+    if args.textual and (selected is None or 'words' in selected):
+        params = dataset.extractor_params or {}
+        if selected is not None:
+            # Features must match those the classifier was trained with
+            config = os.path.dirname(args.extractors)
+            words = WordsFeature.create_from(os.path.join(config,
+                'words.json'))
+        elif 'words' in params:
+            words = WordsFeature()
+            words.set_params(params['words'])
+        else:
+            samples = read_samples(args.dataset)
+            if os.path.isfile(args.stopwords):
+                with open(args.stopwords) as file_:
+                    args.stopwords = file_.read().split()
+            words = WordsFeature(samples, args.stopwords)
+        extractors.append(words)
         # extractors.append(RandomFeature())
+    if selected is not None:
+        extractors = [x for x in extractors if x.name() in selected]
+        missing = set(selected) - set(x.name() for x in extractors)
+        # Otherwise the features would not match the trained classifier
+        assert not missing, 'Cannot create the selected extractors {}'.format(
+            ', '.join(sorted(missing)))
 
-    dataset = Dataset(logging=True)
-    dataset.read(args.dataset, extractors)
+    cache = None
+    if args.cache:
+        cache = FeatureCache(args.cache, args.cache_size * 1024 ** 2)
+
+    profiler = Profiler() if args.profile else None
+
+    if update:
+        dataset.update(args.dataset, extractors, workers=args.jobs,
+            cache=cache, profiler=profiler)
+    else:
+        dataset.read(args.dataset, extractors, workers=args.jobs, cache=cache,
+            profiler=profiler)
     dataset.save(args.output)
+    if cache:
+        cache.close()
+    if profiler:
+        print('')
+        profiler.print_table()
+        profiler.save(args.profile)
@@ -27,6 +27,13 @@ class BlobFeature(Feature):
         yield sizes.mean()
         yield sizes.var()
 
+    def get_params(self):
+        return {'min_size': self.min_size, 'max_size': self.max_size}
+
+    def set_params(self, params):
+        self.min_size = params['min_size']
+        self.max_size = params['max_size']
+
     def show(self, sample):
         fig, ax = pyplot.subplots(1, 1)
         ax.set_title('Blobs by Determinant of Hessian')
@@ -27,6 +27,12 @@ class BriefFeature(Feature):
         descriptor = extractor.descriptors[0].tolist()
         return descriptor
 
+    def get_params(self):
+        return {'length': self.length}
+
+    def set_params(self, params):
+        self.length = params['length']
+
     def _get_points(self, sample):
         points = corner_peaks(corner_harris(sample.gray), min_distance=5)
         center = [int(x / 2) for x in self.size]
@@ -21,13 +21,8 @@ class FaceFeature(Feature):
             'flags': cv2.CASCADE_SCALE_IMAGE
         }
         self.params.update(kwargs)
-        # Create and load classifier
-        self.cascade = cv2.CascadeClassifier()
-        try:
-            self.cascade.load(classifier)
-        except:
-            raise FeatureExtractionError(self,
-                'Error loading pre-trained classifier.')
+        self.classifier = classifier
+        self._load_cascade()
 
     def name(self):
         return 'face'
@@ -42,3 +37,23 @@ class FaceFeature(Feature):
             **self.params)
         amount = len(face_positions)
         yield amount
+
+    def get_params(self):
+        return {'classifier': self.classifier, 'params': self.params}
+
+    def set_params(self, params):
+        self.classifier = params['classifier']
+        self.params = dict(params['params'])
+        # Sizes may have been converted to lists by JSON
+        for key in ('minSize', 'maxSize'):
+            self.params[key] = tuple(self.params[key])
+        self._load_cascade()
+
+    def _load_cascade(self):
+        # Create and load classifier
+        self.cascade = cv2.CascadeClassifier()
+        try:
+            self.cascade.load(self.classifier)
+        except:
+            raise FeatureExtractionError(self,
+                'Error loading pre-trained classifier.')
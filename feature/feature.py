@@ -1,3 +1,7 @@
+import numpy as np
+from helper.image import UnsupportedImageError, ImageLoadingError
+
+
 class Feature:
     """
     Represents a feature extractor that is constructued once and used to
@@ -30,6 +34,17 @@ class Feature:
         """
         raise NotImplementedError
 
+    def extract_batch(self, samples):
+        """
+        Extracts features from a list of samples. Returns a matrix with a row
+        per sample and a column per key, and a list that holds None for every
+        successful row and the raised error for every failed one. The default
+        implementation calls extract() for each sample; extractors that can
+        process many samples at once should override this.
+        """
+        length = len(list(self.keys()))
+        return self._extract_rows(samples, self._extract_row, length)
+
     def get_params(self):
         """
         Parameters should represent the whole state of the feature extractor so
@@ -44,6 +59,30 @@ class Feature:
         """
         pass
 
+    def _extract_row(self, sample):
+        features = list(map(float, self.extract(sample)))
+        length = len(list(self.keys()))
+        if len(features) != length:
+            raise FeatureExtractionError(self, 'Features from {} extractor of '
+                'length {} do not match amount of keys {}'.format(self.name(),
+                len(features), length))
+        return features
+
+    def _extract_rows(self, samples, function, length):
+        """
+        Fill a matrix with the result of the function for each sample. Errors
+        of single samples are collected rather than raised.
+        """
+        features = np.zeros((len(samples), length))
+        errors = [None] * len(samples)
+        for index, sample in enumerate(samples):
+            try:
+                features[index] = function(sample)
+            except (UnsupportedImageError, ImageLoadingError,
+                    FeatureExtractionError) as error:
+                errors[index] = error
+        return features, errors
+
 
 class FeatureExtractionError(Exception):
 
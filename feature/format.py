@@ -1,3 +1,4 @@
+import numpy as np
 from .feature import Feature, FeatureExtractionError
 from helper.image import get_supported
 
@@ -19,3 +20,18 @@ class FormatFeature(Feature):
                 sample.extension)
         for extension in self.supported:
             yield 1 if extension == sample.extension else 0
+
+    def extract_batch(self, samples):
+        extensions = np.array([x.extension for x in samples], dtype=object)
+        features = extensions[:, np.newaxis] == np.array(self.supported)
+        errors = [None] * len(samples)
+        for index in np.flatnonzero(~features.any(axis=1)):
+            errors[index] = FeatureExtractionError(self,
+                'Not supported format' + extensions[index])
+        return features.astype(float), errors
+
+    def get_params(self):
+        return {'supported': list(self.supported)}
+
+    def set_params(self, params):
+        self.supported = tuple(params['supported'])
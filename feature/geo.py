@@ -11,3 +11,7 @@ class GeoFeature(Feature):
 
     def extract(self, sample):
         yield int(bool(sample.lat and sample.long))
+
+    def extract_batch(self, samples):
+        return self._extract_rows(samples,
+            lambda x: bool(x.lat and x.long), 1)
@@ -27,6 +27,12 @@ class GradientFeature(Feature):
         histogram = [x / len(cells) for x in histogram]
         return histogram
 
+    def get_params(self):
+        return {'bins': self.bins}
+
+    def set_params(self, params):
+        self.bins = params['bins']
+
     def show(self, sample):
         _, visualization = skimage.feature.hog(sample.gray,
             orientations=self.bins, visualise=True)
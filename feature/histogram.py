@@ -21,3 +21,9 @@ class HistogramFeature(Feature):
                 range=(0, 1), density=True)
             normalized = histogram * np.diff(edges)
             yield from normalized
+
+    def get_params(self):
+        return {'bins': self.bins}
+
+    def set_params(self, params):
+        self.bins = params['bins']
@@ -1,3 +1,4 @@
+import numpy as np
 from .feature import Feature
 
 
@@ -15,3 +16,11 @@ class SizeFeature(Feature):
         yield sample.width
         yield sample.height
         yield sample.width / sample.height
+
+    def extract_batch(self, samples):
+        sizes, errors = self._extract_rows(samples,
+            lambda x: (x.width, x.height), 2)
+        # Failed rows are zero and get ignored anyway
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratios = sizes[:, 0] / sizes[:, 1]
+        return np.column_stack((sizes, ratios)), errors
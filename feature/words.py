@@ -3,7 +3,7 @@ import re
 import json
 import itertools
 from sklearn.feature_extraction.text import CountVectorizer
-from scipy.sparse import coo_matrix
+from scipy.sparse import coo_matrix, csr_matrix
 import snowballstemmer
 from .feature import Feature, FeatureExtractionError
 
@@ -42,18 +42,30 @@ class WordsFeature(Feature):
         # Check for metadata
         if not sample.metadata:
             raise FeatureExtractionError(self, 'Metadata not found')
-        # Count words
         text = self._preprocess_text(sample.url, sample.title,
             sample.description)
-        term_counts = self.vectorizer.transform([text]).toarray()[0].tolist()
-        # Aggregate term counts into buckets
-        counts = [0 for _ in self.buckets]
-        for term_index, count in enumerate(term_counts):
-            term = self.terms[term_index]
-            for bucket_index, bucket in enumerate(self.buckets):
-                if term in self.vocabulary[bucket]:
-                    counts[bucket_index] += count
-        yield from counts
+        yield from self.count_buckets([text])[0]
+
+    def extract_batch(self, samples):
+        texts, errors = [], []
+        for sample in samples:
+            if sample.metadata:
+                texts.append(self._preprocess_text(sample.url, sample.title,
+                    sample.description))
+                errors.append(None)
+            else:
+                texts.append('')
+                errors.append(FeatureExtractionError(self,
+                    'Metadata not found'))
+        return self.count_buckets(texts).astype(float), errors
+
+    def count_buckets(self, texts):
+        """
+        Count the words of each preprocessed text that fall into each bucket.
+        Returns a dense matrix with a row per text and a column per bucket.
+        """
+        term_counts = self.vectorizer.transform(texts)
+        return term_counts.dot(self.bucket_terms).toarray()
 
     def get_params(self):
         return {
@@ -136,6 +148,17 @@ class WordsFeature(Feature):
         # List of all terms
         self.terms = sorted(set(self._flatten(self.vocabulary.values())))
         self.vectorizer = self._create_vectorizer(self.terms)
+        # Sparse mapping from terms to the buckets containing them, so that
+        # term counts are aggregated into buckets by a matrix product
+        indices = {term: index for index, term in enumerate(self.terms)}
+        rows, columns = [], []
+        for column, bucket in enumerate(self.buckets):
+            for term in set(self.vocabulary[bucket]):
+                rows.append(indices[term])
+                columns.append(column)
+        shape = len(self.terms), len(self.buckets)
+        ones = [1] * len(rows)
+        self.bucket_terms = csr_matrix((ones, (rows, columns)), shape=shape)
 
     def _create_vectorizer(self, terms=None):
         args = {}
@@ -1,11 +1,17 @@
 import os
+import re
 import json
 import uuid
 from datetime import datetime
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
-from helper.download import ensure_directory, download_file
+from helper.download import (ensure_directory, get_filename, Downloader,
+    DownloadError)
+from helper.image import probe_size, UnsupportedImageError, ImageLoadingError
+from helper.cache import QueryCache, DownloadCache
+import helper.dbpedia as dbpedia
+import helper.download as download
 from helper.dbpedia import (fetch_uris_from_metadata, fetch_uris_from_articles,
-    fetch_metadata)
+    fetch_metadata_batch)
 
 
 def read_lines(filename):
@@ -13,34 +19,125 @@ def read_lines(filename):
         return file_.read().splitlines()
 
 
-def images_and_metadata(uris, directory, skip=True, observer=None):
+def images_and_metadata(uris, directory, skip=True, observer=None,
+        workers=8, thumbnails=None):
     """
     For each uri fetch metadata from DBpedia and their image files from
-    Wikimedia Commons. Uris can be either Wikimedia Commons or DBpedia Commons
-    resources.
+    Wikimedia Commons and store them in the directory. Uris can be either
+    Wikimedia Commons or DBpedia Commons resources.
+    """
+    ensure_directory(directory)
+    for metadata, content in fetch_images(uris, skip, observer, workers,
+            thumbnails=thumbnails):
+        identifier = str(uuid.uuid4())
+        try:
+            store_image(metadata['url'], content, directory, identifier)
+            store_metadata(metadata, directory, identifier)
+        except:
+            print('Error storing image')
+
+
+def fetch_images(uris, skip=True, observer=None, workers=8, downloader=None,
+        skip_download=None, thumbnails=None):
+    """
+    Generator over pairs of metadata dictionaries and image file contents for
+    each uri. Metadata is fetched from DBpedia in batches and images are
+    downloaded from Wikimedia Commons into memory. Images are downloaded by
+    multiple threads, so pairs are yielded in the order downloads complete.
+    The optional skip_download function is called with the metadata of each
+    image. Images it returns true for are yielded first with None content.
+    If thumbnails is set to a width, scaled renditions of that width are
+    downloaded instead of the originals when available.
     """
     previous_progress = 0
     if observer != None:
         previous_progress = observer.current
+    if downloader is None:
+        downloader = Downloader(workers)
     uris = list(set(uris))
-    overall = len(uris)
-    for index, uri in enumerate(uris):
-        name = remove_prefix(os.path.basename(uri), 'File:')
-        if observer != None:
-            progress = previous_progress + index / overall * 60
-            observer.update(progress)
-        print('Image {index}/{overall}: {name}'.format(**locals()))
-        uri = ensure_dbpedia_resource(uri)
-        metadata = fetch_metadata(uri)
-        if skip and (not metadata or not metadata['description']):
-            print('Skip image without description')
-            continue
+    resources = {}
+    for uri in uris:
         try:
-            identifier = str(uuid.uuid4())
-            store_image(metadata['url'], directory, identifier)
-            store_metadata(metadata, directory, identifier)
-        except:
-            print('Error downloading image')
+            resources[uri] = ensure_dbpedia_resource(uri)
+        except RuntimeError as error:
+            print(error)
+    print('Fetch metadata of', len(resources), 'images')
+    metadata = fetch_metadata_batch(sorted(set(resources.values())))
+    images = {}
+    for uri, resource in resources.items():
+        properties = metadata[resource]
+        if skip and (not properties or not properties['description']):
+            print('Skip image without description:', uri)
+            continue
+        if properties and skip_download and skip_download(properties):
+            yield properties, None
+            continue
+        images[uri] = properties
+
+    def fetch(uri):
+        if thumbnails:
+            return fetch_thumbnail(images[uri], thumbnails, downloader)
+        return images[uri], downloader.download(images[uri]['url'])
+
+    overall = len(images)
+    try:
+        results = downloader.map(fetch, images)
+        for index, (uri, result) in enumerate(results, 1):
+            name = remove_prefix(os.path.basename(uri), 'File:')
+            if observer != None:
+                progress = previous_progress + index / overall * 60
+                observer.update(progress)
+            print('Image {index}/{overall}: {name}'.format(**locals()))
+            if isinstance(result, Exception):
+                print('Error downloading image')
+                continue
+            yield result
+    finally:
+        downloader.close()
+
+
+def fetch_thumbnail(metadata, width, downloader):
+    """
+    Download a scaled rendition of the image with the given width, falling
+    back to the original if there is none or the original is not wider. The
+    size of the original image is added to the metadata of renditions, so
+    that size features match those of the original.
+    """
+    url = metadata['url']
+    scaled = scaled_url(url, width)
+    if not scaled:
+        return metadata, downloader.download(url)
+    # Read the size of the original image from the start of the file
+    length = 64 * 1024
+    header = downloader.download(url, length)
+    if len(header) != length:
+        # The server responded with the whole file
+        return metadata, header
+    try:
+        size = probe_size(get_filename(url), header)
+    except (UnsupportedImageError, ImageLoadingError):
+        size = None
+    if not size or size[0] <= width:
+        return metadata, downloader.download(url)
+    try:
+        content = downloader.download(scaled)
+    except DownloadError:
+        return metadata, downloader.download(url)
+    metadata = dict(metadata, width=size[0], height=size[1])
+    return metadata, content
+
+
+def scaled_url(url, width):
+    """
+    Return the url of a rendition of the given width of an image on Wikimedia
+    Commons or None if the image has no rendition in the same format.
+    """
+    match = re.match(r'(https?://upload\.wikimedia\.org/wikipedia/commons)'
+        r'/(\w/\w\w)/([^/]+\.(jpe?g|png|gif))$', url, re.IGNORECASE)
+    if not match:
+        return None
+    base, directory, name, _ = match.groups()
+    return '{}/thumb/{}/{}/{}px-{}'.format(base, directory, name, width, name)
 
 
 def ensure_dbpedia_resource(uri):
@@ -49,7 +146,7 @@ def ensure_dbpedia_resource(uri):
     if dbpedia in uri:
         return uri
     elif wikimedia in uri:
-        return dbpedia.replace(wikimedia, dbpedia)
+        return uri.replace(wikimedia, dbpedia)
     else:
         raise RuntimeError('Resource identifier ' + uri +
             ' cannot be converted to DBpedia identifier')
@@ -61,10 +158,11 @@ def store_metadata(metadata, directory, identifier):
         json.dump(metadata, file_)
 
 
-def store_image(url, directory, identifier):
+def store_image(url, content, directory, identifier):
     extension = url.split('.')[-1].lower()
     filename = os.path.join(directory, identifier + '.' + extension)
-    download_file(url, directory, filename, log=False)
+    with open(filename, 'wb') as file_:
+        file_.write(content)
 
 
 def remove_prefix(text, prefix):
@@ -90,8 +188,31 @@ if __name__ == '__main__':
     parser.add_argument('-d', '--directory',
         default='data/fetch/<timestamp>-commons',
         help='Directory to download images into; gets created if not exists')
+    parser.add_argument('-j', '--jobs', type=int, default=8,
+        help='Number of images to download concurrently')
+    parser.add_argument('-t', '--thumbnails', type=int,
+        help='Download scaled renditions of this width instead of the '
+        'original images when available; the original size is stored in '
+        'the metadata')
+    parser.add_argument('-q', '--query-cache', default='data/queries.db',
+        help='Filename of a cache of SPARQL responses; empty to disable')
+    parser.add_argument('--query-ttl', type=float, default=24,
+        help='Hours after which cached SPARQL responses are fetched again')
+    parser.add_argument('--offline', action='store_true',
+        help='Only use cached SPARQL responses and fail for other queries')
+    parser.add_argument('--download-cache',
+        help='Directory of a cache of downloaded images shared between runs')
+    parser.add_argument('--download-cache-size', type=int, default=1024,
+        help='Maximum size of the download cache in megabytes')
     args = parser.parse_args()
 
+    if args.download_cache:
+        download.cache = DownloadCache(args.download_cache,
+            args.download_cache_size * 1024 ** 2)
+    if args.query_cache:
+        dbpedia.cache = QueryCache(args.query_cache, args.query_ttl * 3600,
+            offline=args.offline)
+
     timestamp = str(datetime.now().strftime('%y-%m-%d-%H-%M'))
     directory = args.directory.replace('<timestamp>', timestamp)
     uris = []
@@ -110,4 +231,11 @@ if __name__ == '__main__':
 
     ensure_directory(directory)
     print('Download', len(uris), 'images and metadata into', directory)
-    images_and_metadata(uris, directory)
+    images_and_metadata(uris, directory, workers=args.jobs,
+        thumbnails=args.thumbnails)
+    if dbpedia.cache:
+        print(dbpedia.cache.report())
+        dbpedia.cache.close()
+    if download.cache:
+        print(download.cache.report())
+        download.cache.close()
@@ -0,0 +1,337 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import hashlib
+import numpy as np
+
+
+class SQLiteCache:
+    """
+    Base of the persistent caches. Entries are stored in an SQLite database
+    together with their size in bytes and the time they were last accessed.
+    When the sizes add up to more than max_size bytes, the least recently
+    used entries are evicted. Subclasses define the schema and the table and
+    column that identify entries for eviction.
+    """
+
+    name = None
+    schema = ()
+    table = None
+    column = 'key'
+    # Number of writes after which the size of the cache is checked
+    interval = 100
+
+    def __init__(self, filename, max_size):
+        self.filename = filename
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._connection = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            if not self._connection:
+                return
+            self._evict()
+            self._connection.close()
+            self._connection = None
+
+    def report(self):
+        lookups = self.hits + self.misses
+        rate = self.hits * 100 // lookups if lookups else 0
+        return '{} cache: {} hits, {} misses ({}% hit rate)'.format(
+            self.name, self.hits, self.misses, rate)
+
+    def _connect(self):
+        # Connections cannot be shared with forked worker processes
+        if self._connection and self._pid == os.getpid():
+            return self._connection
+        directory = os.path.dirname(self.filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        # Access from multiple threads is serialized by the lock
+        self._connection = sqlite3.connect(self.filename, timeout=60,
+            check_same_thread=False)
+        # Allow concurrent readers while another process writes
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        for statement in self.schema:
+            self._connection.execute(statement)
+        self._pid = os.getpid()
+        return self._connection
+
+    def _count_writes(self, amount=1):
+        writes = self._writes + amount
+        if writes // self.interval > self._writes // self.interval:
+            self._evict()
+        self._writes = writes
+
+    def _evict(self):
+        """
+        Delete the least recently used entries until the cache fits into its
+        size. Returns the identifiers of the deleted entries.
+        """
+        connection = self._connect()
+        total = connection.execute('SELECT SUM(size) FROM ' + self.table)
+        excess = (total.fetchone()[0] or 0) - self.max_size
+        if excess <= 0:
+            return []
+        victims = []
+        rows = connection.execute('SELECT {}, size FROM {} '
+            'ORDER BY accessed'.format(self.column, self.table))
+        for identifier, size in rows:
+            if excess <= 0:
+                break
+            victims.append((identifier,))
+            excess -= size
+        connection.executemany('DELETE FROM {} WHERE {} = ?'.format(
+            self.table, self.column), victims)
+        connection.commit()
+        return [x for x, in victims]
+
+
+class FeatureCache(SQLiteCache):
+    """
+    Persistent store of feature vectors. Each entry holds the features of a
+    single extractor applied to a single sample. Entries are keyed by the
+    checksum of the sample files and a fingerprint of the extractor, so that
+    changing either the image, its metadata or the parameters of an extractor
+    invalidates the entry. New entries and access times are buffered until
+    commit(), so that no transaction is held open while features are
+    extracted.
+    """
+
+    name = 'Feature'
+    schema = (
+        'CREATE TABLE IF NOT EXISTS features (key TEXT PRIMARY KEY, '
+        'value BLOB, size INTEGER, accessed REAL)',
+        'CREATE INDEX IF NOT EXISTS features_accessed ON features (accessed)',
+    )
+    table = 'features'
+    interval = 1000
+
+    def __init__(self, filename, max_size=1024 ** 3):
+        super().__init__(filename, max_size)
+        self._accessed = []
+        self._pending = []
+
+    def fingerprint(self, extractor):
+        """
+        Return a string identifying the extractor and its parameters.
+        """
+        state = [extractor.name(), list(extractor.keys()),
+            extractor.get_params()]
+        state = json.dumps(state, sort_keys=True, default=str)
+        return hashlib.sha1(state.encode('utf-8')).hexdigest()
+
+    def key(self, sample, fingerprint):
+        return sample.checksum + ':' + fingerprint
+
+    def get(self, key):
+        """
+        Return the cached list of features or None if the key is not stored.
+        """
+        connection = self._connect()
+        row = connection.execute('SELECT value FROM features WHERE key = ?',
+            (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._accessed.append(key)
+        return np.frombuffer(row[0], dtype=np.float64).tolist()
+
+    def put(self, key, features):
+        value = np.array(features, dtype=np.float64).tobytes()
+        self._pending.append((key, value, len(key) + len(value)))
+
+    def commit(self):
+        """
+        Write buffered entries and access times in one short transaction.
+        """
+        if not self._accessed and not self._pending:
+            return
+        connection = self._connect()
+        now = time.time()
+        with connection:
+            connection.executemany('UPDATE features SET accessed = ? '
+                'WHERE key = ?', [(now, x) for x in self._accessed])
+            connection.executemany('INSERT OR REPLACE INTO features '
+                '(key, value, size, accessed) VALUES (?, ?, ?, ?)',
+                [x + (now,) for x in self._pending])
+        written = len(self._pending)
+        self._accessed, self._pending = [], []
+        self._count_writes(written)
+
+    def close(self):
+        self.commit()
+        super().close()
+
+    def pop_stats(self):
+        """
+        Return and reset the hit and miss counters. Used to collect the
+        statistics from worker processes.
+        """
+        stats = self.hits, self.misses
+        self.hits, self.misses = 0, 0
+        return stats
+
+    def merge_stats(self, stats):
+        self.hits += stats[0]
+        self.misses += stats[1]
+
+
+class QueryCache(SQLiteCache):
+    """
+    Persistent store of query responses keyed by a hash of the endpoint and
+    the query text. Entries older than ttl seconds are fetched again. In
+    offline mode, only stored responses are served, regardless of their age,
+    so that recorded responses can be replayed without network access.
+    """
+
+    name = 'Query'
+    schema = (
+        'CREATE TABLE IF NOT EXISTS queries (key TEXT PRIMARY KEY, '
+        'value TEXT, size INTEGER, created REAL, accessed REAL)',
+        'CREATE INDEX IF NOT EXISTS queries_accessed ON queries (accessed)',
+    )
+    table = 'queries'
+
+    def __init__(self, filename, ttl=24 * 3600, max_size=256 * 1024 ** 2,
+            offline=False):
+        super().__init__(filename, max_size)
+        self.ttl = ttl
+        self.offline = offline
+
+    def key(self, endpoint, query):
+        text = endpoint + '\n' + query
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def get(self, endpoint, query):
+        """
+        Return the cached response or None if it is not stored or expired.
+        """
+        key = self.key(endpoint, query)
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute('SELECT value, created FROM queries '
+                'WHERE key = ?', (key,)).fetchone()
+            expired = row and time.time() - row[1] > self.ttl
+            if row is None or (expired and not self.offline):
+                self.misses += 1
+                return None
+            self.hits += 1
+            connection.execute('UPDATE queries SET accessed = ? '
+                'WHERE key = ?', (time.time(), key))
+            connection.commit()
+        return json.loads(row[0])
+
+    def put(self, endpoint, query, response):
+        key = self.key(endpoint, query)
+        value = json.dumps(response)
+        size = len(key) + len(value)
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute('INSERT OR REPLACE INTO queries '
+                '(key, value, size, created, accessed) '
+                'VALUES (?, ?, ?, ?, ?)', (key, value, size, now, now))
+            connection.commit()
+            self._count_writes()
+
+
+class DownloadCache(SQLiteCache):
+    """
+    Store of downloaded files shared between processes. Files are stored
+    once per content hash in the directory and an index maps urls to them.
+    Files are written to temporary names and renamed, so that concurrent
+    readers never see partial files.
+    """
+
+    name = 'Download'
+    schema = (
+        'CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, '
+        'size INTEGER, accessed REAL)',
+        'CREATE INDEX IF NOT EXISTS blobs_accessed ON blobs (accessed)',
+        'CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, '
+        'digest TEXT)',
+        'CREATE INDEX IF NOT EXISTS urls_digest ON urls (digest)',
+    )
+    table = 'blobs'
+    column = 'digest'
+
+    def __init__(self, directory, max_size=1024 ** 3):
+        super().__init__(os.path.join(directory, 'index.db'), max_size)
+        self.directory = directory
+
+    def get(self, url):
+        """
+        Return the content stored for the url or None if it is not stored.
+        """
+        # Only the index is accessed under the lock, files are read after
+        # releasing it so that threads do not wait for each other's reads
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute('SELECT digest FROM urls WHERE url = ?',
+                (url,)).fetchone()
+            if row is not None:
+                connection.execute('UPDATE blobs SET accessed = ? '
+                    'WHERE digest = ?', (time.time(), row[0]))
+                connection.commit()
+        content = self._read(row[0]) if row else None
+        with self._lock:
+            if content is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return content
+
+    def put(self, url, content):
+        digest = hashlib.sha1(content).hexdigest()
+        filename = self._filename(digest)
+        if not os.path.isfile(filename):
+            directory = os.path.dirname(filename)
+            os.makedirs(directory, exist_ok=True)
+            temporary = '{}.{}.{}'.format(filename, os.getpid(),
+                threading.get_ident())
+            with open(temporary, 'wb') as file_:
+                file_.write(content)
+            os.replace(temporary, filename)
+        with self._lock:
+            connection = self._connect()
+            connection.execute('INSERT OR REPLACE INTO blobs '
+                '(digest, size, accessed) VALUES (?, ?, ?)',
+                (digest, len(content), time.time()))
+            connection.execute('INSERT OR REPLACE INTO urls (url, digest) '
+                'VALUES (?, ?)', (url, digest))
+            connection.commit()
+            self._count_writes()
+
+    def _filename(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def _read(self, digest):
+        try:
+            with open(self._filename(digest), 'rb') as file_:
+                return file_.read()
+        except IOError:
+            # Evicted by another process
+            return None
+
+    def _evict(self):
+        victims = super()._evict()
+        connection = self._connect()
+        connection.executemany('DELETE FROM urls WHERE digest = ?',
+            [(x,) for x in victims])
+        connection.commit()
+        for digest in victims:
+            try:
+                os.remove(self._filename(digest))
+            except OSError:
+                pass
+        return victims
@@ -2,18 +2,26 @@ import os
 import json
 import traceback
 import sys
+import signal
+import struct
+from multiprocessing import Pool
 import numpy as np
 from sklearn.cross_validation import train_test_split
 from sklearn.preprocessing import StandardScaler
 from helper.sample import Sample
 from feature.feature import FeatureExtractionError
+import helper.image as image
 from helper.image import is_supported, UnsupportedImageError, ImageLoadingError
 
 
+BINARY_MAGIC = b'DATASET\x01'
+
+
 class Dataset:
 
-    def __init__(self, logging=False):
+    def __init__(self, logging=False, batch_size=256):
         self.logging = logging
+        self.batch_size = batch_size
         self.data = None
         self.target = None
         self.labels = None
@@ -21,68 +29,164 @@ class Dataset:
         self.means = None
         self.stds = None
         self.extractors = None
+        self.extractor_params = None
+        self.files = None
+        self.failed = None
+        self.cache = None
+        self.profiler = None
+        self.decoded = 0
+        self.extracted = None
 
-    def read(self, root, extractors, unlabeled_data=False):
+    def read(self, root, extractors, unlabeled_data=False, workers=1,
+        cache=None, profiler=None):
+        """
+        Read samples from the root directory and extract their features. With
+        more than one worker, samples are distributed across a pool of
+        processes. The order of samples and the resulting data is the same as
+        for a serial run. An optional FeatureCache is used to look up features
+        computed in previous runs and an optional Profiler records the cost of
+        each extractor and of loading the sample attributes.
+        """
         root = root.strip('/\\')
-        self.data, self.target, self.labels = [], [], []
+        self.data, self.target, self.labels, self.files = [], [], [], []
+        self.failed = []
         if not unlabeled_data:
             self._read_samples(root)
         else:
             self._read_unlabeled_samples(root)
         self.extractors = extractors
         self.features = list(self._feature_names())
-        for index, sample in enumerate(self.samples):
-            # Display progress
-            name = sample.filename[len(root) + 1:]
-            self._log_progress(name, index, len(self.samples))
-            # Find label index
-            if sample.label not in self.labels:
-                self.labels.append(sample.label)
-            target = self.labels.index(sample.label)
-            # Extract features
-            features = self._feature_vector(sample)
-            if features:
-                self.data.append(features)
-                self.target.append(target)
-        self._log('Processed', len(self.data), 'samples', ' ' * 61)
+        self._extract(root, workers, cache, profiler)
         self.data = np.array(self.data)
         self.target = np.array(self.target)
         self._validate()
 
-    def load(self, filename):
-        # TODO: Load parameters of feature extractors
+    def extract(self, samples, extractors, workers=1, cache=None,
+        profiler=None):
+        """
+        Extract features of the given samples, for example ones created from
+        downloads in memory, rather than reading them from a directory. Rows of
+        the data correspond to the samples in self.extracted.
+        """
+        self.data, self.target, self.labels = [], [], []
+        self.files = None
+        self.failed = None
+        self.samples = samples
+        self.extractors = extractors
+        self.features = list(self._feature_names())
+        self._extract(None, workers, cache, profiler)
+        self.data = np.array(self.data).reshape(-1, len(self.features))
+        self.target = np.array(self.target)
+        self._validate()
+
+    def update(self, root, extractors, workers=1, cache=None, profiler=None):
+        """
+        Bring a loaded dataset up to date with the images in the root
+        directory. Only new and changed samples are extracted and rows of
+        removed samples are dropped. Samples that failed before are only tried
+        again if their files changed. If the dataset was stored without file
+        information or the extractors differ from the stored ones, all samples
+        are read again.
+        """
+        root = root.strip('/\\')
+        if not self._is_updatable(extractors):
+            self._log('Cannot update dataset, read all samples instead')
+            self.read(root, extractors, workers=workers, cache=cache,
+                profiler=profiler)
+            return
+        stored = {x[0]: (index, x[1]) for index, x in enumerate(self.files)}
+        failed = {x[0]: x[1] for x in self.failed or []}
+        samples = self._read_samples(root)
+        # Keep rows of unchanged samples, skip unchanged samples that failed
+        # and extract the remaining ones
+        keep, delta, self.failed = [], [], []
+        for sample in samples:
+            name = os.path.relpath(sample.filename, root)
+            index, signature = stored.get(name, (None, None))
+            current = self._file_signature(sample.filename)
+            if signature == current:
+                keep.append(index)
+            elif failed.get(name) == current:
+                self.failed.append([name, current])
+            else:
+                delta.append(sample)
+        self._log('Keep', len(keep), 'unchanged samples, skip',
+            len(self.failed), 'unchanged failed samples, drop',
+            len(self.files) - len(keep), 'outdated samples and extract',
+            len(delta), 'samples')
+        data = self.data[keep].reshape(-1, len(self.features))
+        target = self.target[keep]
+        self.files = [self.files[x] for x in keep]
+        self.data, self.target, self.samples = [], [], delta
+        self.extractors = extractors
+        self._extract(root, workers, cache, profiler)
+        added = np.array(self.data).reshape(-1, len(self.features))
+        self.data = np.concatenate((data, added))
+        self.target = np.concatenate((target, self.target)).astype(int)
+        self.samples = samples
+        if self.means is not None:
+            self._update_statistics()
+        self._validate()
+
+    def load(self, filename, features=None):
+        """
+        Load a dataset from a JSON file or, for any other extension, from the
+        binary format written by save(). Binary data is memory-mapped and only
+        read from disk when accessed. If a list of feature names is given,
+        only those columns are loaded.
+        """
         self._log('Load dataset from', filename)
-        with open(filename, 'r') as file_:
-            content = json.load(file_)
-            self.data = np.array(content['data'])
-            self.target = np.array(content['target'])
-            self.labels = content['labels']
-            self.features = content['features']
-            self.means = content['means']
-            self.stds = content['stds']
+        if filename.endswith('.json'):
+            content = self._load_json(filename)
+        else:
+            content = self._load_binary(filename)
+        self.data = content['data']
+        self.target = content['target']
+        self.labels = content['labels']
+        self.features = content['features']
+        self.means = content['means']
+        self.stds = content['stds']
+        self.files = content.get('files')
+        self.failed = content.get('failed')
+        self.extractor_params = content.get('extractors')
+        if features is not None:
+            self._select_features(features)
         self._validate()
         self._log('Done (' + str(len(self.target)) + ')')
 
     def save(self, filename):
-        # TODO: Store parameters of feature extractors
+        """
+        Store the dataset as JSON if the filename ends with .json and in the
+        binary format otherwise.
+        """
         self._log('Save dataset of', len(self.target), 'samples to', filename)
         content = {}
-        content['data'] = self.data.tolist()
-        content['target'] = self.target.tolist()
         content['labels'] = self.labels
         content['features'] = self.features
         content['means'] = self.means
         content['stds'] = self.stds
-        with open(filename, 'w') as file_:
-            json.dump(content, file_)
+        if self.files is not None:
+            content['files'] = self.files
+        if self.failed is not None:
+            content['failed'] = self.failed
+        if self.extractors:
+            content['extractors'] = self._extractor_params(self.extractors)
+        elif self.extractor_params is not None:
+            content['extractors'] = self.extractor_params
+        if filename.endswith('.json'):
+            self._save_json(filename, content)
+        else:
+            self._save_binary(filename, content)
         self._log('Done')
 
-    def split(self, split=0.25, log=True):
+    def split(self, split=0.25, log=True, seed=None):
         """
         Return two new Dataset instances containing the training data and
-        testing data. Filenames are not stored in the new instances.
+        testing data. Filenames are not stored in the new instances. Passing
+        a seed makes the split reproducible.
         """
-        splitted = train_test_split(self.data, self.target, test_size=split)
+        splitted = train_test_split(self.data, self.target, test_size=split,
+            random_state=seed)
         train_data, test_data, train_target, test_target = splitted
         self._log('Training set size', train_target.shape[0])
         self._log('Test set size', test_target.shape[0])
@@ -91,6 +195,13 @@ class Dataset:
         testing = self._create_subset(test_data, test_target)
         return training, testing
 
+    def subset(self, indices):
+        """
+        Return a new Dataset instance containing the rows at the indices.
+        Filenames are not stored in the new instance.
+        """
+        return self._create_subset(self.data[indices], self.target[indices])
+
     def normalize(self):
         """
         Normalize dataset either from its own statistical properties or from
@@ -105,7 +216,156 @@ class Dataset:
             scaler.fit(self.data)
             self.means = scaler.mean_.tolist()
             self.stds = scaler.std_.tolist()
-        self.data = scaler.transform(self.data, copy=False)
+        # Memory-mapped data is read-only
+        copy = not self.data.flags.writeable
+        self.data = scaler.transform(self.data, copy=copy)
+
+    def _load_json(self, filename):
+        with open(filename, 'r') as file_:
+            content = json.load(file_)
+        content['data'] = np.array(content['data'])
+        content['target'] = np.array(content['target'])
+        return content
+
+    def _save_json(self, filename, content):
+        content['data'] = self.data.tolist()
+        content['target'] = self.target.tolist()
+        with open(filename, 'w') as file_:
+            json.dump(content, file_)
+
+    def _load_binary(self, filename):
+        """
+        The binary format starts with a magic string and the length of a JSON
+        header holding everything but the data and targets. It is followed by
+        the data as float32 matrix in column-major order, so that single
+        features are contiguous on disk, and the targets as int32 vector.
+        """
+        with open(filename, 'rb') as file_:
+            magic = file_.read(len(BINARY_MAGIC))
+            assert magic == BINARY_MAGIC, 'Unknown dataset format'
+            length, = struct.unpack('<Q', file_.read(8))
+            content = json.loads(file_.read(length).decode('utf-8'))
+        rows, columns = content.pop('rows'), len(content['features'])
+        offset = len(BINARY_MAGIC) + 8 + length
+        if not rows:
+            content['data'] = np.empty((0, columns), np.float32)
+            content['target'] = np.empty(0, np.int32)
+            return content
+        content['data'] = np.memmap(filename, np.float32, 'r', offset,
+            (rows, columns), order='F')
+        offset += content['data'].nbytes
+        content['target'] = np.memmap(filename, np.int32, 'r', offset, rows)
+        return content
+
+    def _save_binary(self, filename, content):
+        content['rows'] = len(self.target)
+        header = json.dumps(content).encode('utf-8')
+        # Pad the header to align the data for memory-mapping
+        header += b' ' * (-(len(BINARY_MAGIC) + 8 + len(header)) % 64)
+        data = np.asfortranarray(self.data, np.float32)
+        target = np.asarray(self.target, np.int32)
+        with open(filename, 'wb') as file_:
+            file_.write(BINARY_MAGIC)
+            file_.write(struct.pack('<Q', len(header)))
+            file_.write(header)
+            # The transpose of a column-major matrix is row-major
+            data.T.tofile(file_)
+            target.tofile(file_)
+
+    def _select_features(self, features):
+        """
+        Restrict the dataset to the feature columns of the given names. Reads
+        only those columns of memory-mapped data.
+        """
+        indices = [self.features.index(x) for x in features]
+        self.data = np.array(self.data[:, indices])
+        self.features = list(features)
+        if self.means is not None:
+            self.means = [self.means[x] for x in indices]
+            self.stds = [self.stds[x] for x in indices]
+
+    def _extract(self, root, workers, cache, profiler):
+        """
+        Extract features of self.samples and append them to the lists of data,
+        targets and files. Samples that were extracted successfully are stored
+        in self.extracted, the files of failed ones in self.failed. Without a
+        root directory, no file information is stored.
+        """
+        self.cache = cache
+        self.profiler = profiler
+        if self.profiler:
+            self.profiler.activate()
+        if self.cache:
+            extractors = self.extractors
+            self._fingerprints = [cache.fingerprint(x) for x in extractors]
+        self.decoded = 0
+        self.extracted = []
+        results = self._extract_samples(workers)
+        for index, (sample, features) in enumerate(results):
+            # Display progress
+            name = sample.filename
+            if root is not None:
+                name = os.path.relpath(name, root)
+            self._log_progress(name, index, len(self.samples))
+            # Find label index
+            if sample.label not in self.labels:
+                self.labels.append(sample.label)
+            target = self.labels.index(sample.label)
+            # Store features
+            if features:
+                self.data.append(features)
+                self.target.append(target)
+                self.extracted.append(sample)
+                if root is not None:
+                    signature = self._file_signature(sample.filename)
+                    self.files.append([name, signature])
+            elif root is not None:
+                signature = self._file_signature(sample.filename)
+                self.failed.append([name, signature])
+        self._log('Processed', len(self.data), 'samples', ' ' * 61)
+        self._log('Decoded', self.decoded, 'images')
+        if self.cache:
+            self._log(self.cache.report())
+        if self.profiler:
+            self.profiler.deactivate()
+
+    def _is_updatable(self, extractors):
+        if self.files is None:
+            return False
+        names = [x.name() for x in extractors]
+        features = list(self._feature_names(extractors))
+        params = self._extractor_params(extractors)
+        if self.extractor_params is not None:
+            stored = [self.extractor_params.get(x) for x in names]
+            if stored != [params[x] for x in names]:
+                return False
+        return features == self.features
+
+    def _extractor_params(self, extractors):
+        """
+        Parameters of the extractors by their names. Converted the same way
+        as when stored to JSON so that they can be compared to loaded ones.
+        """
+        params = {x.name(): x.get_params() for x in extractors}
+        return json.loads(json.dumps(params))
+
+    def _update_statistics(self):
+        scaler = StandardScaler()
+        scaler.fit(self.data)
+        self.means = scaler.mean_.tolist()
+        self.stds = scaler.std_.tolist()
+
+    def _file_signature(self, filename):
+        """
+        Size and modification times of the image file and its metadata file.
+        Used to detect changed samples without reading their content.
+        """
+        metadata = os.path.splitext(filename)[0] + '.json'
+        status = os.stat(filename)
+        signature = [status.st_size, status.st_mtime]
+        if os.path.isfile(metadata):
+            signature.append(os.stat(metadata).st_mtime)
+        return signature
 
     def _read_samples(self, root):
         assert os.path.isdir(root)
@@ -155,37 +415,136 @@ class Dataset:
             if is_supported(filename):
                 yield filename
 
-    def _feature_names(self):
-        for extractor in self.extractors:
+    def _feature_names(self, extractors=None):
+        for extractor in extractors or self.extractors:
             name = extractor.name()
             for key in extractor.keys():
                 yield name + '_' + key
 
-    def _feature_vector(self, sample):
-        # Extract features
-        combined = []
-        for extractor in self.extractors:
-            features = self._apply_extractor(sample, extractor)
-            if not features:
-                return None
-            combined += features
-        return combined
-
-    def _apply_extractor(self, sample, extractor):
+    def _extract_samples(self, workers):
+        """
+        Generator over pairs of samples and their feature vectors in the order
+        of self.samples. Feature vectors are None for samples that failed.
+        Samples are passed to the extractors in batches.
+        """
+        size = self.batch_size
+        if workers > 1:
+            # Make sure that all workers get batches to process
+            size = min(size, len(self.samples) // workers + 1)
+        batches = [self.samples[x: x + size]
+            for x in range(0, len(self.samples), size)]
+        if workers <= 1:
+            for batch in batches:
+                vectors, stats = self._process_batch(batch)
+                self._merge_stats(stats)
+                yield from zip(batch, vectors)
+            return
+        with Pool(workers, _initialize_worker, (self,)) as pool:
+            results = pool.imap(_extract_worker, batches)
+            for batch, (vectors, stats) in zip(batches, results):
+                self._merge_stats(stats)
+                yield from zip(batch, vectors)
+
+    def _process_batch(self, samples):
+        """
+        Extract the feature vectors of a batch of samples. Also returns
+        statistics about the extraction, so that they can be collected from
+        worker processes.
+        """
+        decoded = image.decode_count
+        vectors = self._feature_vectors(samples)
+        stats = {'decoded': image.decode_count - decoded}
+        if self.cache:
+            self.cache.commit()
+            stats['cache'] = self.cache.pop_stats()
+        if self.profiler:
+            stats['profile'] = self.profiler.pop_records()
+        return vectors, stats
+
+    def _merge_stats(self, stats):
+        self.decoded += stats['decoded']
+        if self.cache:
+            self.cache.merge_stats(stats['cache'])
+        if self.profiler:
+            self.profiler.merge_records(stats['profile'])
+
+    def _feature_vectors(self, samples):
+        """
+        Extract features of a batch of samples. Returns a list with the
+        combined feature vector of each sample or None if any of the
+        extractors failed on it.
+        """
+        vectors = [[] for _ in samples]
+        for index, extractor in enumerate(self.extractors):
+            remaining = [x for x in range(len(samples)) if vectors[x]
+                is not None]
+            batch = [samples[x] for x in remaining]
+            features, errors = self._apply_extractor(batch, extractor, index)
+            for row, sample_index in enumerate(remaining):
+                if errors[row] is not None:
+                    vectors[sample_index] = None
+                else:
+                    vectors[sample_index] += features[row].tolist()
+        return vectors
+
+    def _apply_extractor(self, samples, extractor, index):
+        """
+        Extract features of a batch of samples with a single extractor. Look up
+        features in the cache if one is used and only extract the missing ones.
+        """
+        features = np.zeros((len(samples), len(list(extractor.keys()))))
+        errors = [None] * len(samples)
+        missing = list(range(len(samples)))
+        if self.cache:
+            fingerprint = self._fingerprints[index]
+            keys = [self.cache.key(x, fingerprint) for x in samples]
+            missing = []
+            for row, key in enumerate(keys):
+                cached = self.cache.get(key)
+                if cached is None:
+                    missing.append(row)
+                else:
+                    features[row] = cached
+            # Never hold the write lock of the cache while extracting
+            self.cache.commit()
+        if not missing:
+            return features, errors
         try:
-            features = extractor.extract(sample)
-            features = list(map(float, features))
-            self._validate_extraction(features, extractor)
-            return features
+            batch = [samples[x] for x in missing]
+            if self.profiler:
+                with self.profiler.measure(extractor.name(), len(batch)):
+                    extracted, failures = extractor.extract_batch(batch)
+            else:
+                extracted, failures = extractor.extract_batch(batch)
+            self._validate_extraction(extracted, len(missing), extractor)
+        except FeatureExtractionError as error:
+            # The batch cannot be assigned to samples, so drop all of them
+            self._log_error(error)
+            for row in missing:
+                errors[row] = error
+            return features, errors
         except KeyboardInterrupt:
             sys.exit(1)
-        except UnsupportedImageError:
+        for row, values, error in zip(missing, extracted, failures):
+            if error is not None:
+                self._log_error(error)
+                errors[row] = error
+                continue
+            features[row] = values
+            if self.cache:
+                self.cache.put(keys[row], values)
+        if self.cache:
+            self.cache.commit()
+        return features, errors
+
+    def _log_error(self, error):
+        if isinstance(error, UnsupportedImageError):
             self._log('\nUnsupported image format')
-        except ImageLoadingError:
+        elif isinstance(error, ImageLoadingError):
             self._log('\nError opening image')
-        except FeatureExtractionError as extractor:
-            self._log('\nError extracting features in', extractor)
-            traceback.print_exc()
+        else:
+            self._log('\nError extracting features in', error)
+            traceback.print_exception(type(error), error, error.__traceback__)
 
     def _create_subset(self, data, target):
         dataset = Dataset()
@@ -199,13 +558,12 @@ class Dataset:
         assert len(self.data) == len(self.target)
         assert isinstance(self.features[0], str)
 
-    def _validate_extraction(self, features, extractor):
-        len_features = len(list(features))
-        len_keys = len(list(extractor.keys()))
-        if len_features != len_keys:
+    def _validate_extraction(self, features, amount, extractor):
+        shape = amount, len(list(extractor.keys()))
+        if features.shape != shape:
             raise FeatureExtractionError(extractor, 'Features from {} '
-                'extractor of length {} do not match amount of keys {}'.format(
-                extractor.name(), len_features, len_keys))
+                'extractor of shape {} do not match amount of samples and '
+                'keys {}'.format(extractor.name(), features.shape, shape))
 
     def _log(self, *args, **kwargs):
         if self.logging:
@@ -216,3 +574,26 @@ class Dataset:
         percent = current * 100 // overall
         self._log('Process [{: >3}%] {: <61}'.format(percent, name),
             flush=True, end='\r')
+
+
+# Dataset of the current worker process, set by the pool initializer. The
+# extractors are inherited from the parent process rather than sent with every
+# task.
+_worker_dataset = None
+
+
+def _initialize_worker(dataset):
+    global _worker_dataset
+    # Leave handling of keyboard interrupts to the parent process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_dataset = dataset
+    # Discard statistics inherited from the parent process
+    if dataset.cache:
+        dataset.cache.pop_stats()
+    if dataset.profiler:
+        dataset.profiler.pop_records()
+        dataset.profiler.activate()
+
+
+def _extract_worker(samples):
+    return _worker_dataset._process_batch(samples)
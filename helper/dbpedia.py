@@ -1,6 +1,16 @@
 from SPARQLWrapper import SPARQLWrapper, JSON
+from SPARQLWrapper.SPARQLExceptions import QueryBadFormed
 
 
+ENDPOINT = 'http://commons.dbpedia.org/sparql'
+
+# Optional QueryCache that responses are served from and stored in
+cache = None
+
+
+class OfflineError(LookupError):
+    pass
+
 METADATA = {
     'url': 'http://dbpedia.org/ontology/fileURL',
     'thumbnail': 'http://dbpedia.org/ontology/thumbnail',
@@ -33,25 +43,38 @@ def fetch_uris_from_articles(keywords, amount):
 
 
 def fetch_metadata(uri):
-    resource = '<{}>'.format(uri)
-    # Download all properties from the global METADATA dictionary
-    metadata = fetch_properties(resource, list(METADATA.values()))
-    if not metadata:
-        return None
-    # Use simple key names
-    for key, value in METADATA.items():
-        if value in metadata:
-            metadata[key] = metadata.pop(value)
-    return metadata
-
-
-def fetch_properties(resource, properties):
+    return fetch_metadata_batch([uri])[uri]
+
+
+def fetch_metadata_batch(uris, batch_size=100):
+    """
+    Fetch the properties of the global METADATA dictionary for many resources
+    using one query per batch of uris. Returns a dictionary from uri to
+    metadata, which is None if the query for its batch failed. Batches that
+    the endpoint rejects as malformed are split, so that only the uris
+    causing the error lose their metadata.
+    """
+    results = {}
+    for start in range(0, len(uris), batch_size):
+        results.update(_fetch_metadata(uris[start:start + batch_size]))
+    return results
+
+
+def fetch_properties(resources, properties):
+    """
+    Return the properties of the resources or None if the query failed.
+    Queries the endpoint rejects as malformed raise QueryBadFormed, so that
+    callers can narrow down the offending resources.
+    """
     try:
-        data = query_properties(resource)
-        properties = parse_properties(data, properties)
+        data = query_properties(resources, properties)
+        properties = parse_properties(data, resources, properties)
         return properties
+    except QueryBadFormed:
+        raise
     except:
-        print('Error retrieving', resource.strip('<>'))
+        print('Error retrieving', len(resources), 'resources starting with',
+            resources[0].strip('<>'))
 
 
 def query_uris_from_keywords(ontology, keywords, amount, multiple=True):
@@ -79,10 +102,13 @@ def query_uris(filters, amount=5000):
     return result
 
 
-def query_properties(resource):
+def query_properties(resources, properties):
+    resources = ' '.join(resources)
+    properties = ' '.join('<{}>'.format(x) for x in properties)
     query = """SELECT DISTINCT ?subject ?predicate ?object WHERE {{
-            ?subject ?predicate ?object
-            FILTER (?subject = {resource}) }}""".format(**locals())
+            VALUES ?subject {{ {resources} }}
+            VALUES ?predicate {{ {properties} }}
+            ?subject ?predicate ?object }}""".format(**locals())
     result = execute_query(query)
     return result
 
@@ -92,19 +118,60 @@ def parse_uris(json):
         yield result['uri']['value']
 
 
-def parse_properties(data, predicates):
-    properties = {x: '' for x in predicates}
+def parse_properties(data, resources, predicates):
+    """
+    Return a dictionary from resource uri to a dictionary of the predicates
+    and their values. Missing predicates are set to empty strings.
+    """
+    properties = {}
+    for resource in resources:
+        resource = resource.strip('<>')
+        properties[resource] = {x: '' for x in predicates}
     for result in data['results']['bindings']:
+        subject = result['subject']['value']
         predicate = result['predicate']['value']
-        if predicate in predicates:
-            properties[predicate] = result['object']['value']
+        if subject in properties and predicate in predicates:
+            properties[subject][predicate] = result['object']['value']
     return properties
 
 
 def execute_query(query):
-    sparql = SPARQLWrapper('http://commons.dbpedia.org/sparql')
+    if cache:
+        data = cache.get(ENDPOINT, query)
+        if data is not None:
+            return data
+        if cache.offline:
+            raise OfflineError('Query is not cached: ' + ' '.join(
+                query.split())[:200])
+    sparql = SPARQLWrapper(ENDPOINT)
     sparql.setQuery(query)
     sparql.setReturnFormat(JSON)
     sparql.setTimeout(60)  # one minute
     data = sparql.query().convert()
+    if cache:
+        cache.put(ENDPOINT, query, data)
     return data
+
+
+def _fetch_metadata(uris):
+    resources = ['<{}>'.format(x) for x in uris]
+    try:
+        # Download all properties from the global METADATA dictionary
+        properties = fetch_properties(resources, list(METADATA.values()))
+    except QueryBadFormed:
+        if len(uris) == 1:
+            print('Error retrieving malformed resource', uris[0])
+            return {uris[0]: None}
+        middle = len(uris) // 2
+        results = _fetch_metadata(uris[:middle])
+        results.update(_fetch_metadata(uris[middle:]))
+        return results
+    results = {}
+    for uri in uris:
+        metadata = properties.get(uri) if properties else None
+        if metadata:
+            # Use simple key names
+            metadata = {key: metadata[value]
+                for key, value in METADATA.items()}
+        results[uri] = metadata
+    return results
@@ -1,8 +1,160 @@
 import shutil
 import os
 import re
+import time
+import threading
+import http.client
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib.request import urlopen
-from urllib.parse import urlsplit, urlunsplit, quote
+from urllib.parse import urlsplit, urlunsplit, urljoin, quote
+
+
+# Optional DownloadCache that files are served from and stored in
+cache = None
+
+
+class DownloadError(IOError):
+    pass
+
+
+class Downloader:
+    """
+    Downloads files over HTTP from multiple threads. Connections are kept
+    alive and reused for further requests to the same host. At most per_host
+    requests run against a single host at the same time. Failed requests
+    are retried with exponentially growing pauses in between; client errors
+    like 404 are not retried. If a list of hosts is given, urls of other
+    hosts are refused, including redirect targets.
+    """
+
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+
+    def __init__(self, workers=8, per_host=4, retries=3, backoff=0.5,
+            timeout=60, hosts=None):
+        self.workers = workers
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.hosts = hosts
+        self._idle = {}
+        self._limits = {}
+        self._lock = threading.Lock()
+
+    def download(self, url, length=None, redirects=5):
+        """
+        Return the content of the file at the url as bytes. If length is
+        given, only the first length bytes are requested. Servers may still
+        respond with the whole file.
+        """
+        url = encode_uri(url)
+        if not self.is_allowed(url):
+            raise DownloadError('Host is not allowed: ' + url)
+        headers = {}
+        if length:
+            headers['Range'] = 'bytes=0-{}'.format(length - 1)
+        key = url + ('#' + headers['Range'] if length else '')
+        content = cache.get(key) if cache else None
+        if content is None:
+            content = self._download(url, headers, redirects)
+            if cache:
+                cache.put(key, content)
+        return content
+
+    def is_allowed(self, url):
+        """
+        Whether the url uses HTTP and, if hosts are restricted, one of the
+        allowed hosts.
+        """
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            return False
+        return self.hosts is None or parts.hostname in self.hosts
+
+    def map(self, function, items):
+        """
+        Apply the function to all items using the thread pool. Yields pairs of
+        item and result in the order the calls complete. If a call raised,
+        the exception is yielded as the result.
+        """
+        with ThreadPoolExecutor(self.workers) as executor:
+            futures = {executor.submit(function, x): x for x in items}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as error:
+                    result = error
+                yield futures[future], result
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def _download(self, url, headers, redirects):
+        for attempt in range(self.retries + 1):
+            try:
+                status, location, content = self._request(url, headers)
+            except (OSError, http.client.HTTPException) as error:
+                status, location, content = None, None, error
+            if status in (301, 302, 303, 307, 308) and location:
+                if redirects <= 0:
+                    raise DownloadError('Too many redirects for ' + url)
+                target = urljoin(url, location)
+                if not self.is_allowed(target):
+                    raise DownloadError('Host is not allowed: ' + target)
+                return self._download(target, headers, redirects - 1)
+            if status == 200 or (status == 206 and 'Range' in headers):
+                return content
+            if status is not None and status not in self.RETRY_STATUS:
+                raise DownloadError('HTTP {} for {}'.format(status, url))
+            if attempt < self.retries:
+                time.sleep(self.backoff * 2 ** attempt)
+        if status is None:
+            raise DownloadError('Could not download {}: {}'.format(
+                url, content))
+        raise DownloadError('HTTP {} for {}'.format(status, url))
+
+    def _request(self, url, headers):
+        scheme, host, path, query, _ = urlsplit(url)
+        path = (path or '/') + ('?' + query if query else '')
+        key = scheme, host
+        with self._limit(key):
+            connection = self._acquire(key)
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                content = response.read()
+            except:
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(key, connection)
+        return response.status, response.getheader('Location'), content
+
+    def _limit(self, key):
+        with self._lock:
+            if key not in self._limits:
+                self._limits[key] = threading.BoundedSemaphore(self.per_host)
+            return self._limits[key]
+
+    def _acquire(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop()
+        scheme, host = key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, timeout=self.timeout)
+        return http.client.HTTPConnection(host, timeout=self.timeout)
+
+    def _release(self, key, connection):
+        with self._lock:
+            self._idle.setdefault(key, []).append(connection)
 
 
 def get_filename(url):
@@ -10,8 +162,13 @@ def get_filename(url):
 
 
 def encode_uri(uri):
+    """
+    Percent-encode the path of the uri. Existing escapes are kept, so that
+    encoding an encoded uri, like the target of a redirect, leaves it as is.
+    """
     chunks = list(urlsplit(uri))
-    chunks[2] = quote(chunks[2])
+    path = re.sub(r'%(?![0-9A-Fa-f]{2})', '%25', chunks[2])
+    chunks[2] = quote(path, safe='/%')
     uri = urlunsplit(chunks)
     return uri
 
@@ -24,8 +181,17 @@ def download_file(url, directory, filename=None, log=True):
     url = encode_uri(url)
     if log:
         print('Download image:', basename)
-    with urlopen(url) as response, open(filename, 'wb') as file_:
-        shutil.copyfileobj(response, file_)
+    if not cache:
+        with urlopen(url) as response, open(filename, 'wb') as file_:
+            shutil.copyfileobj(response, file_)
+        return
+    content = cache.get(url)
+    if content is None:
+        with urlopen(url) as response:
+            content = response.read()
+        cache.put(url, content)
+    with open(filename, 'wb') as file_:
+        file_.write(content)
 
 
 def download_files(urls, directory):
@@ -1,11 +1,21 @@
 import os
 import io
+import re
+import xml.etree.ElementTree as ElementTree
 import numpy as np
 import skimage
 import cairosvg
 from PIL import Image
 
 
+# Number of images fully decoded by load() in this process
+decode_count = 0
+
+# Pixels per unit of SVG lengths as used by CairoSVG at 96 DPI
+SVG_UNITS = {'': 1, 'px': 1, 'in': 96, 'cm': 96 / 2.54, 'mm': 96 / 25.4,
+    'pt': 96 / 72, 'pc': 96 / 6}
+
+
 class UnsupportedImageError(Exception):
     pass
 
@@ -86,31 +96,108 @@ def is_supported(filename):
     return True
 
 
-def convert_svg(filename):
+def convert_svg(filename, content=None):
     """
-    Converts a SVG image to PNG format and returns it as a file object.
+    Converts a SVG image to PNG format and returns it as a file object. If the
+    content of the file is given, the filename is not read.
     """
     assert filename.endswith('.svg')
-    basename, extension = os.path.splitext(filename)
-    png = cairosvg.svg2png(url=filename)
+    if content is not None:
+        png = cairosvg.svg2png(bytestring=content)
+    else:
+        png = cairosvg.svg2png(url=filename)
     return io.BytesIO(png)
 
 
-def open_image(filename):
+def open_image(filename, content=None):
+    """
+    Open an image from its filename or, if given, from the content of the file
+    already in memory. The filename then only determines the format.
+    """
     if filename.lower().endswith('.svg'):
-        png = convert_svg(filename)
+        png = convert_svg(filename, content)
         return Image.open(png)
+    elif content is not None:
+        return Image.open(io.BytesIO(content))
     else:
         return Image.open(filename)
 
 
-def load(filename, clamp_size=True):
+def probe_size(filename, content=None):
+    """
+    Read the dimensions of an image from its header without decoding the
+    pixels. Returns None if the size of an SVG image cannot be determined
+    without rendering it.
+    """
     if not is_supported(filename):
         raise UnsupportedImageError
     try:
-        image = open_image(filename)
-        image = ensure_rgb(image)
+        if content is not None:
+            file_ = io.BytesIO(content)
+        else:
+            file_ = open(filename, 'rb')
+        with file_:
+            if filename.lower().endswith('.svg'):
+                return probe_svg_size(file_)
+            return Image.open(file_).size
+    except:
+        raise ImageLoadingError
+
+
+def probe_svg_size(file_):
+    """
+    Determine the size of the rendered SVG image from the width and height
+    attributes of the root element, falling back to its viewBox the same way
+    CairoSVG does. Only the opening root tag is parsed.
+    """
+    _, root = next(ElementTree.iterparse(file_, events=('start',)))
+    width = parse_svg_length(root.get('width'))
+    height = parse_svg_length(root.get('height'))
+    viewbox = root.get('viewBox')
+    if viewbox:
+        viewbox = [float(x) for x in re.split(r'[\s,]+', viewbox.strip())]
+        width = width or viewbox[2]
+        height = height or viewbox[3]
+    if int(width) <= 0 or int(height) <= 0:
+        return None
+    return int(width), int(height)
+
+
+def parse_svg_length(text):
+    """
+    Convert an absolute SVG length to pixels. Returns zero for missing and
+    relative lengths.
+    """
+    match = re.match(r'^\s*([+-]?[\d.]+(?:e[+-]?\d+)?)\s*([a-z%]*)\s*$',
+        text or '', re.IGNORECASE)
+    if not match or match.group(2).lower() not in SVG_UNITS:
+        return 0
+    return float(match.group(1)) * SVG_UNITS[match.group(2).lower()]
+
+
+def reduce_on_load(image, width=512, height=512):
+    """
+    Ask the decoder to decode the image at a reduced resolution that is still
+    at least the specified dimensions. Only has an effect on JPEG images whose
+    decoder can scale down by a power of two. Must be called before the image
+    data is loaded.
+    """
+    size = (width, height)
+    image.draft(image.mode, size)
+
+
+def load(filename, clamp_size=True, content=None):
+    global decode_count
+    if not is_supported(filename):
+        raise UnsupportedImageError
+    decode_count += 1
+    try:
+        image = open_image(filename, content)
+        # Opening only reads the header, so this is the original size
         size = image.size
+        if clamp_size:
+            reduce_on_load(image)
+        image = ensure_rgb(image)
         if clamp_size:
             max_size = (512, 512)
             image.thumbnail(max_size)
@@ -0,0 +1,210 @@
+import os
+import json
+import struct
+import numpy as np
+
+
+MODEL_MAGIC = b'MODEL\x00\x00\x01'
+
+
+def export_model(classifier, filename):
+    """
+    Store a trained random forest or linear SVM in a compact binary format
+    of flat arrays that can be loaded without unpickling. The format starts
+    with a magic string and the length of a JSON header describing the
+    arrays, followed by the arrays aligned for memory-mapping.
+    """
+    kind = type(classifier).__name__
+    if kind == 'RandomForestClassifier':
+        header, arrays = _export_forest(classifier)
+        features = classifier.estimators_[0].tree_.n_features
+    elif kind == 'SVC' and classifier.kernel == 'linear':
+        header, arrays = _export_linear_svm(classifier)
+        features = classifier.coef_.shape[1]
+    else:
+        raise ValueError('Cannot export ' + kind + ', only random forests '
+            'and SVMs with linear kernel are supported')
+    header['classes'] = classifier.classes_.tolist()
+    header['features'] = features
+    header['arrays'] = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset += -offset % 64
+        header['arrays'][name] = {'dtype': array.dtype.str,
+            'shape': array.shape, 'offset': offset}
+        offset += array.nbytes
+    content = json.dumps(header).encode('utf-8')
+    # Pad the header to align the arrays
+    content += b' ' * (-(len(MODEL_MAGIC) + 8 + len(content)) % 64)
+    start = len(MODEL_MAGIC) + 8 + len(content)
+    with open(filename, 'wb') as file_:
+        file_.write(MODEL_MAGIC)
+        file_.write(struct.pack('<Q', len(content)))
+        file_.write(content)
+        for name, array in arrays.items():
+            file_.seek(start + header['arrays'][name]['offset'])
+            file_.write(np.ascontiguousarray(array).tobytes())
+
+
+def export_verified(classifier, filename, amount=10000):
+    """
+    Export the classifier and compare the predictions of the exported model
+    with its own. The file is only put in place if all predictions agree,
+    otherwise a previous file of the name is removed, so that a faulty model
+    never replaces the classifier it was exported from. Returns the fraction
+    of equal predictions.
+    """
+    temporary = filename + '.tmp'
+    export_model(classifier, temporary)
+    agreement = compare_predictions(classifier, load_model(temporary), amount)
+    if agreement < 1:
+        for name in (temporary, filename):
+            if os.path.isfile(name):
+                os.remove(name)
+    else:
+        os.replace(temporary, filename)
+    return agreement
+
+
+def compare_predictions(classifier, model, amount, seed=0):
+    """
+    Return the fraction of equal predictions of both models on random
+    normalized feature vectors.
+    """
+    generator = np.random.RandomState(seed)
+    data = generator.randn(amount, model.features)
+    return np.mean(classifier.predict(data) == model.predict(data))
+
+
+def load_model(filename):
+    """
+    Load a model written by export_model(). Arrays are memory-mapped, so
+    that processes loading the same file share its pages.
+    """
+    with open(filename, 'rb') as file_:
+        magic = file_.read(len(MODEL_MAGIC))
+        assert magic == MODEL_MAGIC, 'Unknown model format'
+        length, = struct.unpack('<Q', file_.read(8))
+        header = json.loads(file_.read(length).decode('utf-8'))
+    start = len(MODEL_MAGIC) + 8 + length
+    arrays = {}
+    for name, array in header['arrays'].items():
+        arrays[name] = np.memmap(filename, np.dtype(array['dtype']), 'r',
+            start + array['offset'], tuple(array['shape']))
+    if header['kind'] == 'forest':
+        return CompactForest(header, arrays)
+    return CompactLinearSVM(header, arrays)
+
+
+class CompactForest:
+    """
+    Random forest stored as flat node arrays of all trees. Internal nodes
+    hold a feature, a threshold and the indices of both children. For leaves,
+    the left child encodes the row of the class probabilities as -1 - row.
+    Predictions match those of the original forest.
+    """
+
+    def __init__(self, header, arrays):
+        self.classes_ = np.array(header['classes'])
+        self.features = header['features']
+        self.roots = arrays['roots']
+        self.feature = arrays['feature']
+        self.threshold = arrays['threshold']
+        self.left = arrays['left']
+        self.right = arrays['right']
+        self.values = arrays['values']
+
+    def predict(self, data):
+        probabilities = self.predict_proba(data)
+        return self.classes_.take(np.argmax(probabilities, axis=1))
+
+    def predict_proba(self, data):
+        # Trees compare single precision features like scikit-learn does
+        data = np.asarray(data, dtype=np.float32)
+        rows = np.arange(len(data))[:, np.newaxis]
+        nodes = np.tile(np.asarray(self.roots), (len(data), 1))
+        while True:
+            left = self.left[nodes]
+            internal = left >= 0
+            if not internal.any():
+                break
+            values = data[rows, self.feature[nodes]]
+            children = np.where(values <= self.threshold[nodes], left,
+                self.right[nodes])
+            nodes = np.where(internal, children, nodes)
+        leaves = -1 - self.left[nodes]
+        # Sum in the order of trees to get the same rounding
+        probabilities = np.zeros((len(data), self.values.shape[1]))
+        for tree in range(leaves.shape[1]):
+            probabilities += self.values[leaves[:, tree]]
+        return probabilities / leaves.shape[1]
+
+
+class CompactLinearSVM:
+    """
+    Multi-class SVM with linear kernel stored as the weights and biases of
+    its one-vs-one classifiers. Predictions are made by voting between the
+    pairs of classes like libsvm does.
+    """
+
+    def __init__(self, header, arrays):
+        self.classes_ = np.array(header['classes'])
+        self.features = header['features']
+        self.coef = arrays['coef']
+        self.intercept = arrays['intercept']
+
+    def predict(self, data):
+        decisions = np.dot(data, np.asarray(self.coef).T) + self.intercept
+        amount = len(self.classes_)
+        # A single classifier whose positive side is the second class
+        if amount == 2:
+            return self.classes_.take((decisions[:, 0] > 0).astype(int))
+        votes = np.zeros((len(data), amount), dtype=int)
+        rows = np.arange(len(data))
+        pair = 0
+        for first in range(amount):
+            for second in range(first + 1, amount):
+                winner = np.where(decisions[:, pair] > 0, first, second)
+                votes[rows, winner] += 1
+                pair += 1
+        return self.classes_.take(np.argmax(votes, axis=1))
+
+
+def _export_forest(forest):
+    roots, feature, threshold, left, right, values = [], [], [], [], [], []
+    nodes, leaves = 0, 0
+    for estimator in forest.estimators_:
+        tree = estimator.tree_
+        assert tree.n_outputs == 1, 'Multi-output forests are not supported'
+        is_leaf = tree.children_left == -1
+        # Leaves reference their row of class probabilities
+        leaf_rows = np.cumsum(is_leaf) - 1 + leaves
+        roots.append(nodes)
+        feature.append(np.where(is_leaf, 0, tree.feature))
+        threshold.append(tree.threshold)
+        left.append(np.where(is_leaf, -1 - leaf_rows,
+            tree.children_left + nodes))
+        right.append(np.where(is_leaf, -1, tree.children_right + nodes))
+        proba = tree.value[is_leaf, 0, :]
+        normalizer = proba.sum(axis=1)[:, np.newaxis]
+        normalizer[normalizer == 0] = 1
+        values.append(proba / normalizer)
+        nodes += tree.node_count
+        leaves += is_leaf.sum()
+    arrays = {
+        'roots': np.array(roots, dtype=np.int32),
+        'feature': np.concatenate(feature).astype(np.int32),
+        'threshold': np.concatenate(threshold).astype(np.float64),
+        'left': np.concatenate(left).astype(np.int32),
+        'right': np.concatenate(right).astype(np.int32),
+        'values': np.concatenate(values).astype(np.float64),
+    }
+    return {'kind': 'forest'}, arrays
+
+
+def _export_linear_svm(svm):
+    arrays = {
+        'coef': np.asarray(svm.coef_, dtype=np.float64),
+        'intercept': np.asarray(svm.intercept_, dtype=np.float64),
+    }
+    return {'kind': 'linear-svm'}, arrays
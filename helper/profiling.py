@@ -0,0 +1,125 @@
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+# Profiler that lazy-loaded sample attributes report to, if any
+active = None
+
+
+class Profiler:
+    """
+    Records wall time, CPU time and peak memory allocation of named sections.
+    Times are exclusive, so time spent in a nested section, for example a
+    sample attribute that is lazy-loaded by an extractor, is only counted for
+    the inner section. Peak allocations include nested sections.
+    """
+
+    def __init__(self):
+        self.records = {}
+        self._stack = []
+
+    def activate(self):
+        global active
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        active = self
+
+    def deactivate(self):
+        global active
+        if active is self:
+            active = None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    @contextmanager
+    def measure(self, name, samples=1):
+        frame = self._enter()
+        try:
+            yield
+        finally:
+            self._exit(name, samples, frame)
+
+    def pop_records(self):
+        """
+        Return and reset the records. Used to collect the records from worker
+        processes.
+        """
+        records, self.records = self.records, {}
+        return records
+
+    def merge_records(self, records):
+        for name, other in records.items():
+            record = self._record(name)
+            for key in ('calls', 'samples', 'wall', 'cpu'):
+                record[key] += other[key]
+            record['peak'] = max(record['peak'], other['peak'])
+
+    def report(self):
+        """
+        Return the records sorted by descending wall time.
+        """
+        records = sorted(self.records.items(), key=lambda x: x[1]['wall'],
+            reverse=True)
+        return [dict(name=name, **record) for name, record in records]
+
+    def save(self, filename):
+        with open(filename, 'w') as file_:
+            json.dump(self.report(), file_, indent=2)
+
+    def print_table(self):
+        row = '| {: <20} | {: >8} | {: >9} | {: >9} | {: >9} | {: >9} |'
+        print(row.format('section', 'samples', 'wall s', 'cpu s',
+            'ms/sample', 'peak MB'))
+        print(row.format(*(['-' * 20] + ['-' * 8] + ['-' * 9] * 4)))
+        for record in self.report():
+            per_sample = 1000 * record['wall'] / max(record['samples'], 1)
+            print(row.format(record['name'][:20], record['samples'],
+                '{:.2f}'.format(record['wall']),
+                '{:.2f}'.format(record['cpu']),
+                '{:.2f}'.format(per_sample),
+                '{:.1f}'.format(record['peak'] / 1024 ** 2)))
+
+    def _enter(self):
+        frame = {'children_wall': 0, 'children_cpu': 0, 'peak': 0}
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            # Keep the peak of the enclosing section before resetting it
+            if self._stack:
+                parent = self._stack[-1]
+                parent['peak'] = max(parent['peak'], peak)
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            frame['memory'] = current
+        frame['wall'] = time.perf_counter()
+        frame['cpu'] = time.process_time()
+        self._stack.append(frame)
+        return frame
+
+    def _exit(self, name, samples, frame):
+        wall = time.perf_counter() - frame['wall']
+        cpu = time.process_time() - frame['cpu']
+        self._stack.pop()
+        peak = 0
+        if 'memory' in frame and tracemalloc.is_tracing():
+            peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+            if self._stack:
+                parent = self._stack[-1]
+                parent['peak'] = max(parent['peak'], peak)
+            peak -= frame['memory']
+        if self._stack:
+            self._stack[-1]['children_wall'] += wall
+            self._stack[-1]['children_cpu'] += cpu
+        record = self._record(name)
+        record['calls'] += 1
+        record['samples'] += samples
+        record['wall'] += wall - frame['children_wall']
+        record['cpu'] += cpu - frame['children_cpu']
+        record['peak'] = max(record['peak'], peak)
+
+    def _record(self, name):
+        if name not in self.records:
+            self.records[name] = {'calls': 0, 'samples': 0, 'wall': 0,
+                'cpu': 0, 'peak': 0}
+        return self.records[name]
@@ -1,20 +1,56 @@
 import os
 import json
+import hashlib
 import helper.image as image
+import helper.profiling as profiling
 from helper.dbpedia import METADATA
 
 
+# Attributes whose loading is measured when a profiler is active
+PROFILED_ATTRIBUTES = ('original', 'size', 'image', 'hsv', 'gray', 'metadata',
+    'checksum')
+
+# Attributes each extractor relies on
+REQUIREMENTS = {
+    'size': ('size',),
+    'color': ('original', 'image'),
+    'histogram': ('hsv',),
+    'gradient': ('gray',),
+    'blob': ('gray',),
+    'face': ('original',),
+    'geo': ('metadata',),
+    'format': ('metadata',),
+    'words': ('metadata',),
+}
+
+# Attributes that loading an attribute relies on
+DEPENDENCIES = {
+    'original': ('metadata',),
+    'size': ('metadata',),
+    'image': ('original',),
+    'hsv': ('image',),
+    'gray': ('image',),
+    'metadata': (),
+}
+
+
 class Sample:
     """
     Represents a sample of the dataset. From the image filename, all supported
     attributes are lazy-loaded on access. To add attributes to this class, just
     provide a new _load_<key>() method and make sure to call _ensure() on all
     attributes this method relies on, so that those can be lazy-loaded as well.
+
+    Samples can also be created from an image file content and a metadata
+    dictionary that are already in memory. The filename is then only used to
+    determine the image format and no files are read.
     """
 
-    def __init__(self, filename, label=None):
+    def __init__(self, filename, label=None, content=None, properties=None):
         self.filename = filename
         self.label = label
+        self.content = content
+        self.properties = properties
 
     def __getattr__(self, key):
         """
@@ -40,7 +76,11 @@ class Sample:
             return
         loader_name = '_load_' + key
         loader = object.__getattribute__(self, loader_name)
-        loader()
+        if profiling.active and key in PROFILED_ATTRIBUTES:
+            with profiling.active.measure('sample.' + key):
+                loader()
+        else:
+            loader()
         assert self._has_attr(key), ('Loader {loader_name} did not load '
             '{key}'.format(**locals()))
 
@@ -53,12 +93,37 @@ class Sample:
 
     def _load_original(self):
         self._ensure('filename')
+        # The image may be a scaled rendition and the metadata hold the size
+        # of the original image
+        self._ensure('metadata')
         # Size must be set here as well since even the original image may be
         # scaled down a little bit inside image.load() for performance reasons.
-        self.original, self.size = image.load(self.filename)
+        self.original, size = image.load(self.filename, content=self.content)
+        if not self._has_attr('size'):
+            self.size = size
 
     def _load_size(self):
+        """
+        Use the original size from the metadata if present. Otherwise, read
+        the size from the image header if possible so that no pixel data
+        needs to be decoded.
+        """
+        self._ensure('filename')
+        self._ensure('metadata')
+        if self._has_attr('size'):
+            return
+        size = image.probe_size(self.filename, self.content)
+        if size:
+            self.size = size
+        else:
+            self._ensure('original')
+
+    def _load_scale(self):
+        """
+        Factor by which the original image was scaled down when loading.
+        """
         self._ensure('original')
+        self.scale = self.size[0] / self.original.shape[1]
 
     def _load_width(self):
         self._ensure('size')
@@ -82,19 +147,56 @@ class Sample:
 
     def _load_metadata(self):
         self._ensure('filename')
+        dictionary = self._read_metadata()
+        if dictionary is not None:
+            assert METADATA.keys() <= set(dictionary), 'Invalid metadata'
+            self.metadata = True
+        else:
+            self.metadata = False
+            dictionary = {key: '' for key in METADATA}
+            dictionary['extension'] = os.path.splitext(self.filename)[1][1:]
+        # Metadata of scaled renditions contains the original size
+        width, height = dictionary.get('width'), dictionary.get('height')
+        if width and height and not self._has_attr('size'):
+            self.size = int(width), int(height)
+        # Update attributes from dictionary
+        for key in METADATA:
+            setattr(self, key, dictionary[key])
+
+    def _read_metadata(self):
+        """
+        Return the metadata dictionary or None if there is no metadata.
+        """
+        if self.content is not None:
+            return self.properties
         filename = self._replace_extension(self.filename, 'json')
         try:
             with open(filename) as file_:
-                dictionary = json.load(file_)
-                assert set(dictionary.keys()) == METADATA.keys(), 'Invalid metadata'
-                self.metadata = True
+                return json.load(file_)
         except IOError:
-            self.metadata = False
-            dictionary = {key: '' for key in keys}
-            dictionary['extension'] = os.path.splitext(self.filename)[1][1:]
-        # Update attributes from dictionary
-        for key, value in dictionary.items():
-            setattr(self, key, value)
+            return None
+
+    def _load_checksum(self):
+        """
+        Hash of the image file and its metadata file if present. Identifies
+        the content of the sample independent of its location.
+        """
+        self._ensure('filename')
+        checksum = hashlib.sha1()
+        if self.content is not None:
+            checksum.update(self.content)
+            if self.properties is not None:
+                properties = json.dumps(self.properties, sort_keys=True)
+                checksum.update(properties.encode('utf-8'))
+            self.checksum = checksum.hexdigest()
+            return
+        metadata = self._replace_extension(self.filename, 'json')
+        for filename in (self.filename, metadata):
+            if not os.path.isfile(filename):
+                continue
+            with open(filename, 'rb') as file_:
+                checksum.update(file_.read())
+        self.checksum = checksum.hexdigest()
 
     def _replace_extension(self, filename, extension):
         basename, _ = os.path.splitext(filename)
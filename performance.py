@@ -1,5 +1,8 @@
+import os
+import numpy as np
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
-from classifier import evaluate_classifier
+from classifier import (evaluate_classifiers, cross_validate,
+    save_out_of_fold, EvaluationPlan)
 from sklearn.neighbors import KNeighborsClassifier
 from sklearn.svm import SVC, LinearSVC
 from sklearn.ensemble import RandomForestClassifier
@@ -33,18 +36,72 @@ if __name__ == '__main__':
         help='Fraction of data used for validation')
     parser.add_argument('-i', '--iterations', type=int, default=20,
         help='Number of times each algorithm is trained and tested')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+        help='Number of processes to train and test classifiers in parallel')
+    parser.add_argument('--seed', type=int, default=0,
+        help='Random seed of the first split; iterations use following seeds')
+    parser.add_argument('--cv', type=int,
+        help='Number of folds of a stratified cross validation to run '
+        'instead of random splits')
+    parser.add_argument('-r', '--repeat', type=int, default=1,
+        help='Number of times the cross validation is repeated with '
+        'different shuffles')
+    parser.add_argument('-o', '--out-of-fold',
+        help='Filename to store the out-of-fold predictions of all '
+        'classifiers in as NumPy archive')
+    parser.add_argument('-p', '--plan',
+        help='Filename to store the splits and their normalization statistics '
+        'in; reused by later runs on the same dataset with the same '
+        'arguments, for example <features>.plan')
     args = parser.parse_args()
 
+    if args.plan:
+        args.plan = args.plan.replace('<features>', args.features)
+
     dataset = Dataset()
     dataset.load(args.features)
 
-    results = {}
-    for name, classifier in get_classifiers().items():
-        result = evaluate_classifier(dataset, classifier, args.iterations,
-            args.split)
-        results[name] = result
+    plan = EvaluationPlan()
+    if args.cv:
+        parameters = dict(folds=args.cv, repeats=args.repeat, seed=args.seed)
+    else:
+        parameters = dict(iterations=args.iterations, split=args.split,
+            seed=args.seed)
+    if args.plan and os.path.isfile(args.plan):
+        plan.load(args.plan)
+    if not plan.matches(dataset, parameters):
+        if args.cv:
+            plan.create_folds(dataset, args.cv, args.repeat, args.seed)
+        else:
+            plan.create(dataset, args.iterations, args.split, args.seed)
+        if args.plan:
+            print('Store evaluation plan in', args.plan)
+            plan.save(args.plan)
+    else:
+        print('Reuse evaluation plan from', args.plan)
 
-    results = sorted(results.items(), key=lambda x: x[1][1], reverse=True)
-    for name, (worst, average, best) in results:
-        print('{name: <35} {worst: 4.2f} {average: 4.2f} {best: 4.2f}'.format(
-            **locals()))
+    if args.cv:
+        evaluations = cross_validate(dataset, get_classifiers(), args.cv,
+            args.repeat, args.jobs, plan=plan)
+        if args.out_of_fold:
+            save_out_of_fold(args.out_of_fold, dataset, evaluations)
+        results = {}
+        for name, (scores, seconds, _) in evaluations.items():
+            results[name] = np.mean(scores), np.std(scores), seconds
+        results = sorted(results.items(), key=lambda x: x[1][0],
+            reverse=True)
+        for name, (mean, std, seconds) in results:
+            print('{name: <35} {mean: 4.2f} +/- {std: 4.2f} '
+                '{seconds: 8.2f}s'.format(**locals()))
+    else:
+        evaluations = evaluate_classifiers(dataset, get_classifiers(),
+            args.iterations, args.split, args.jobs, args.seed, plan)
+        results = {}
+        for name, (scores, seconds, _) in evaluations.items():
+            average = sum(scores) / len(scores)
+            results[name] = min(scores), average, max(scores), seconds
+        results = sorted(results.items(), key=lambda x: x[1][1],
+            reverse=True)
+        for name, (worst, average, best, seconds) in results:
+            print('{name: <35} {worst: 4.2f} {average: 4.2f} {best: 4.2f} '
+                '{seconds: 8.2f}s'.format(**locals()))
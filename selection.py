@@ -0,0 +1,324 @@
+import os
+import json
+import shutil
+import itertools
+import numpy as np
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from sklearn.externals import joblib
+from sklearn.ensemble import RandomForestClassifier
+from classifier import cross_validate
+from evaluation import compute_chi, write_csv
+from helper.dataset import Dataset
+from helper.sample import REQUIREMENTS, DEPENDENCIES
+from helper.model import export_verified
+from helper.utility import print_headline
+
+
+# Benchmarks of benchmark.py that measure loading a sample attribute
+ATTRIBUTE_BENCHMARKS = {
+    'original': 'load',
+    'size': 'probe_size',
+    'image': 'preprocess',
+    'hsv': 'convert_to_hsv',
+    'gray': 'convert_to_gray',
+}
+
+
+def load_costs(filename):
+    """
+    Read the milliseconds per sample spent in each extractor and for loading
+    each sample attribute, named sample.<attribute>, from either a profile
+    written by extraction.py or results written by benchmark.py.
+    """
+    with open(filename) as file_:
+        content = json.load(file_)
+    costs = {}
+    if isinstance(content, list):
+        for record in content:
+            samples = max(record['samples'], 1)
+            costs[record['name']] = 1000 * record['wall'] / samples
+        return costs
+    results = content['results']
+    for name, rate in results.items():
+        costs[name] = 1000 / rate
+    for attribute, benchmark in ATTRIBUTE_BENCHMARKS.items():
+        if benchmark in results:
+            costs['sample.' + attribute] = 1000 / results[benchmark]
+    return costs
+
+
+def subset_cost(extractors, costs):
+    """
+    Milliseconds per sample to run the extractors. Sample attributes are
+    loaded once no matter how many extractors rely on them.
+    """
+    attributes = set()
+    pending = [x for name in extractors for x in REQUIREMENTS.get(name, ())]
+    while pending:
+        attribute = pending.pop()
+        if attribute not in attributes:
+            attributes.add(attribute)
+            pending.extend(DEPENDENCIES.get(attribute, ()))
+    cost = sum(costs.get(x, 0) for x in extractors)
+    cost += sum(costs.get('sample.' + x, 0) for x in attributes)
+    return cost
+
+
+def compute_importances(dataset, classifier):
+    """
+    Return the importance of each extractor as the sum over its features of
+    the average of the normalized chi values and the forest importances.
+    """
+    # compute_chi() modifies the data, so pass a copy
+    _, chis = compute_chi(dataset.subset(np.arange(len(dataset.target))))
+    chis = np.nan_to_num(np.array(chis))
+    chis /= chis.sum() or 1
+    normalized = dataset.subset(np.arange(len(dataset.target)))
+    normalized.normalize()
+    forest = RandomForestClassifier(**classifier.get_params())
+    forest.fit(normalized.data, normalized.target)
+    features = (chis + forest.feature_importances_) / 2
+    importances = {}
+    for feature, importance in zip(dataset.features, features):
+        name = extractor_name(feature)
+        importances[name] = importances.get(name, 0) + importance
+    return importances
+
+
+def propose_subsets(importances, costs):
+    """
+    Return nested subsets of the extractors in the order of the dataset,
+    starting with all of them. Each subset drops the extractor of the
+    previous one that has the lowest importance per millisecond it saves.
+    """
+    remaining = list(importances)
+    subsets = [tuple(remaining)]
+    while len(remaining) > 1:
+        cost = subset_cost(remaining, costs)
+        def value(name):
+            others = [x for x in remaining if x != name]
+            saved = cost - subset_cost(others, costs)
+            # Dropping extractors that save nothing does not pay off
+            return importances[name] / saved if saved > 0 else float('inf')
+        remaining.remove(min(remaining, key=value))
+        subsets.append(tuple(remaining))
+    return subsets
+
+
+def all_subsets(extractors):
+    return [subset for size in range(len(extractors), 0, -1)
+        for subset in itertools.combinations(extractors, size)]
+
+
+def evaluate_subsets(dataset, subsets, classifier, folds, repeats, workers,
+        seed=0):
+    """
+    Cross validate the classifier on the features of each subset. The folds
+    only depend on the targets and the seed, so that all subsets are
+    evaluated on the same folds. Returns a list of the mean and standard
+    deviation of F1 scores per subset.
+    """
+    scores = []
+    for subset in subsets:
+        selected = select_features(dataset, subset)
+        results = cross_validate(selected, {'': classifier}, folds, repeats,
+            workers, seed)
+        scores.append((np.mean(results[''][0]), np.std(results[''][0])))
+    return scores
+
+
+def pareto_front(candidates):
+    """
+    Return the candidates of cost and score pairs that no other candidate
+    beats in both, ordered by cost.
+    """
+    front = []
+    for candidate in sorted(candidates, key=lambda x: (x[0], -x[1])):
+        if not front or candidate[1] > front[-1][1]:
+            front.append(candidate)
+    return front
+
+
+def choose(front, tolerance, budget=None):
+    """
+    Return the best candidate within the budget if given, otherwise the
+    cheapest candidate whose score is at most tolerance below the best score.
+    """
+    if budget is not None:
+        affordable = [x for x in front if x[0] <= budget]
+        assert affordable, 'No subset of extractors fits into the budget'
+        return max(affordable, key=lambda x: x[1])
+    best = max(x[1] for x in front)
+    return next(x for x in front if x[1] >= best - tolerance)
+
+
+def select_features(dataset, extractors):
+    """
+    Return a copy of the dataset restricted to the features of the
+    extractors.
+    """
+    features = [x for x in dataset.features
+        if extractor_name(x) in extractors]
+    selected = dataset.subset(np.arange(len(dataset.target)))
+    selected._select_features(features)
+    return selected
+
+
+def extractor_name(feature):
+    return feature.split('_', 1)[0]
+
+
+def save_selection(directory, dataset, extractors, classifier,
+        trained_faces):
+    """
+    Train the classifier on the features of the extractors and store it
+    together with the normalization statistics and the list of extractors,
+    so that the directory can be used as classifier directory of the web
+    application.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    selected = select_features(dataset, extractors)
+    selected.normalize()
+    classifier.fit(selected.data, selected.target)
+    joblib.dump(classifier, os.path.join(directory, 'classifier.pkl'))
+    agreement = export_verified(classifier, os.path.join(directory,
+        'classifier.model'))
+    assert agreement == 1, 'Exported model does not predict like the forest'
+    config = {
+        'means': selected.means,
+        'stds': selected.stds,
+        'extractors': list(extractors),
+        'features': selected.features,
+    }
+    with open(os.path.join(directory, 'dataset.json'), 'w') as file_:
+        json.dump(config, file_)
+    # Files the selected extractors are created from
+    params = dataset.extractor_params or {}
+    if 'words' in extractors:
+        assert 'words' in params, 'Dataset has no stored vocabulary'
+        with open(os.path.join(directory, 'words.json'), 'w') as file_:
+            json.dump(params['words'], file_)
+    if 'face' in extractors:
+        shutil.copy(trained_faces, os.path.join(directory,
+            'trained-faces.xml'))
+
+
+def print_extractors(importances, costs):
+    row = '| {: <12} | {: >10} | {: >14} |'
+    print(row.format('extractor', 'importance', 'ms/sample'))
+    print(row.format('-' * 12, '-' * 10, '-' * 14))
+    for name, importance in sorted(importances.items(), key=lambda x: x[1],
+            reverse=True):
+        cost = subset_cost([name], costs)
+        print(row.format(name, '{:.4f}'.format(importance),
+            '{:.2f}'.format(cost)))
+
+
+def print_candidates(candidates, front, chosen):
+    row = '| {: >10} | {: >17} | {: <6} | {}'
+    print(row.format('ms/sample', 'F1', 'pareto', 'extractors'))
+    print(row.format('-' * 10, '-' * 17, '-' * 6, '-' * 10))
+    for candidate in sorted(candidates, key=lambda x: x[0]):
+        cost, mean, std, subset = candidate
+        mark = 'yes' if candidate in front else ''
+        if candidate is chosen:
+            mark = 'chosen'
+        print(row.format('{:.2f}'.format(cost),
+            '{:.4f} +/- {:.4f}'.format(mean, std), mark, ' '.join(subset)))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Select the extractors worth their '
+        'cost. Candidate subsets of extractors are proposed from the chi '
+        'values and forest importances of their features and their measured '
+        'cost. The subsets on the Pareto front of cross validated F1 score '
+        'and cost are reported and a classifier is trained on the chosen '
+        'one.',
+        formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('features',
+        help='Path to the JSON or binary file containing extracted features '
+        'of the dataset')
+    parser.add_argument('costs',
+        help='Profile written by extraction.py --profile or results written '
+        'by benchmark.py to take the cost of extractors from')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.01,
+        help='Choose the cheapest subset whose F1 score is at most this '
+        'much below the best one')
+    parser.add_argument('-b', '--budget', type=float,
+        help='Choose the best subset that takes at most this many '
+        'milliseconds per sample instead')
+    parser.add_argument('-e', '--exhaustive', action='store_true',
+        help='Evaluate all subsets of extractors rather than only dropping '
+        'the least valuable extractor one by one')
+    parser.add_argument('--cv', type=int, default=5,
+        help='Number of folds of the stratified cross validation')
+    parser.add_argument('-r', '--repeat', type=int, default=1,
+        help='Number of times the cross validation is repeated with '
+        'different shuffles')
+    parser.add_argument('-n', '--trees', type=int, default=100,
+        help='Number of trees of the random forest classifier')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+        help='Number of processes to train and test folds in parallel')
+    parser.add_argument('--seed', type=int, default=0,
+        help='Random seed of the folds and the classifier')
+    parser.add_argument('-f', '--trained-faces',
+        default='classifier/trained-faces.xml',
+        help='Path to the trained face detection classifier, copied to the '
+        'output directory if the face extractor is selected')
+    parser.add_argument('-o', '--output', default='<folder>/selection',
+        help='Directory to store the classifier and the configuration of '
+        'the selected extractors in, to be used as classifier directory of '
+        'the web application and with extraction.py --extractors; <folder> '
+        'is the directory of the features file')
+    args = parser.parse_args()
+
+    folder = os.path.split(args.features)[0]
+    args.output = args.output.replace('<folder>', folder)
+
+    dataset = Dataset()
+    dataset.load(args.features)
+    costs = load_costs(args.costs)
+    classifier = RandomForestClassifier(n_estimators=args.trees,
+        random_state=args.seed)
+
+    importances = compute_importances(dataset, classifier)
+    for name in importances:
+        if name not in costs:
+            print('No cost measured for the {} extractor, assume that it '
+                'only loads sample attributes'.format(name))
+    print_headline('Extractors')
+    print_extractors(importances, costs)
+
+    if args.exhaustive:
+        subsets = all_subsets(list(importances))
+    else:
+        subsets = propose_subsets(importances, costs)
+    print('\nCross validate', len(subsets), 'subsets of extractors')
+    scores = evaluate_subsets(dataset, subsets, classifier, args.cv,
+        args.repeat, args.jobs, args.seed)
+    candidates = [(subset_cost(subset, costs), mean, std, subset)
+        for subset, (mean, std) in zip(subsets, scores)]
+    front = pareto_front(candidates)
+    chosen = choose(front, args.tolerance, args.budget)
+    print_headline('Candidates')
+    print_candidates(candidates, front, chosen)
+
+    cost, mean, _, extractors = chosen
+    full = candidates[0]
+    print('\nChosen subset takes {:.2f} instead of {:.2f} ms/sample with F1 '
+        'score {:.4f} instead of {:.4f}'.format(cost, full[0], mean,
+        full[1]))
+    print('Write classifier and configuration to', args.output)
+    save_selection(args.output, dataset, extractors, classifier,
+        args.trained_faces)
+    captions = ('extractors', 'ms/sample', 'f1', 'std', 'pareto')
+    data = (
+        [' '.join(x[3]) for x in candidates],
+        [x[0] for x in candidates],
+        [x[1] for x in candidates],
+        [x[2] for x in candidates],
+        [x in front for x in candidates],
+    )
+    write_csv(os.path.join(args.output, 'candidates.csv'), captions, data)
+    print('Done')